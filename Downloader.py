@@ -28,10 +28,11 @@ def split_list(to_split, n=1):
 if __name__ == '__main__':
     setup_logging()
 
-    def download_channel(id, category, convert=False, depth=None):
+    def download_channel(id, category, convert=False, depth=None,
+                         backfill=False):
         try:
             c = Channel(id, category=category)
-            for v in c.uploads(depth=depth):
+            for v in c.uploads(depth=depth, backfill=backfill):
                 try:
                     v.download(convert=convert)
                 except:
@@ -50,6 +51,6 @@ if __name__ == '__main__':
         for id in politics.values():
             exec.submit(download_channel, id, 'Politics', False, 50)
         for id in politics.values():
-            exec.submit(download_channel, id, 'Politics', False, None)
+            exec.submit(download_channel, id, 'Politics', False, None, True)
         for id in politics.values():
             exec.submit(download_channel, id, 'Politics', True, None)
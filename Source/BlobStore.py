@@ -0,0 +1,189 @@
+from datetime import timedelta
+from pathlib import Path
+from threading import Lock
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import requests
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+
+class BlobStore:
+    """Downloaded pages, stored once each by the hash of their content.
+
+    Responses are streamed to disk in chunks while they're hashed, so memory
+    use doesn't depend on page size, and identical content fetched from any
+    number of urls (or cited by any number of videos) is stored once.  An
+    index maps each url to its blob along with the ETag and Last-Modified
+    headers it was served with; a url fetched within max_age isn't requested
+    again, and an older one is only re-downloaded if the server says it has
+    changed.
+    """
+
+    def __init__(self,
+                 path: Path = Path(ROOT_DIR, 'Sources'),
+                 max_age: timedelta = timedelta(days=1),
+                 timeout: float = 30,
+                 chunk_size: int = 64 * 1024):
+        self.path = Path(path)
+        self.blob_dir = Path(self.path, 'blobs')
+        self.max_age = max_age
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        self.lock = Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(Path(self.path, 'index.sqlite')),
+                                         timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    blob TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched REAL NOT NULL
+                )""")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def blob_path(self, blob: str):
+        return Path(self.blob_dir, blob[:2], blob)
+
+    def lookup(self, url: str):
+        """Returns the index entry for url as a dictionary, or None"""
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM urls WHERE url = ?",
+                                       (url,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            entry = dict(zip([c[0] for c in cursor.description], row))
+        if not self.blob_path(entry['blob']).exists():
+            return None
+        return entry
+
+    def store_chunks(self, chunks):
+        """Writes chunks to a blob and returns (blob, size)"""
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        (fd, tmp_path) = tempfile.mkstemp(dir=str(self.blob_dir))
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    outfile.write(chunk)
+                    size += len(chunk)
+            blob = digest.hexdigest()
+            blob_path = self.blob_path(blob)
+            if blob_path.exists():
+                os.remove(tmp_path)
+            else:
+                blob_path.parents[0].mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return (blob, size)
+
+    def index(self, url: str, blob: str, size: int, content_type: str = None,
+              etag: str = None, last_modified: str = None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, blob, size, content_type, etag, last_modified,
+                 time.time()))
+            self.conn.commit()
+
+    def touch(self, url: str):
+        with self.lock:
+            self.conn.execute("UPDATE urls SET fetched = ? WHERE url = ?",
+                              (time.time(), url))
+            self.conn.commit()
+
+    def write(self, url: str, chunks):
+        """Stores an already open stream of chunks for url, so a BlobStore
+        can be used as a Crawler sink.
+        """
+        (blob, size) = self.store_chunks(chunks)
+        self.index(url, blob, size)
+        return blob
+
+    def fetch(self, url: str):
+        """Returns the blob for url, downloading it only if it isn't stored
+        yet or the server reports that it has changed.
+        """
+        entry = self.lookup(url)
+        if entry is not None and \
+           time.time() - entry['fetched'] < self.max_age.total_seconds():
+            return entry['blob']
+
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        with self.session.get(url, headers=headers, timeout=self.timeout,
+                              stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                self.touch(url)
+                return entry['blob']
+            response.raise_for_status()
+            (blob, size) = self.store_chunks(
+                response.iter_content(self.chunk_size))
+            self.index(url, blob, size,
+                       response.headers.get('Content-Type'),
+                       response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+        return blob
+
+    def link(self, blob: str, dest_path: Path):
+        """Makes blob available at dest_path (e.g. in a video's directory)
+        without copying it, if the filesystem allows.
+        """
+        dest_path = Path(dest_path)
+        dest_path.parents[0].mkdir(parents=True, exist_ok=True)
+        if dest_path.exists():
+            if os.path.samefile(dest_path, self.blob_path(blob)):
+                return dest_path
+            dest_path.unlink()
+        try:
+            os.link(self.blob_path(blob), dest_path)
+        except OSError:
+            # hardlinks can't cross filesystems
+            shutil.copyfile(self.blob_path(blob), dest_path)
+        return dest_path
+
+    def close(self):
+        self.session.close()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __len__(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()
+        return count
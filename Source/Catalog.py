@@ -0,0 +1,401 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from threading import RLock
+import csv
+import json
+import os
+import re
+import sqlite3
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+MEDIA_KINDS = ('audio', 'video', 'combined')
+
+# bumped whenever the tables change; an index with an older layout is dropped
+# and rebuilt from the directory tree
+SCHEMA_VERSION = 2
+
+
+def parse_length(value):
+    """Video length in seconds, from either a number of seconds (YouTube.py
+    info.json) or a str(timedelta) (yt.py info.json).
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    days = 0
+    if 'day' in value:
+        (day_part, value) = value.split(', ')
+        days = int(day_part.split(' ')[0])
+    (hours, minutes, seconds) = value.split(':')
+    return days * 86400 + int(hours) * 3600 + int(minutes) * 60 + \
+           float(seconds)
+
+
+def video_id(info: dict):
+    return info.get('id') or re.split('v=', info['url'])[-1]
+
+
+def file_kind(name: str, id: str):
+    if name in ('combined.mp4', '%s.mp4' % id):
+        return 'combined'
+    if name == 'audio.mp4' or name.startswith('[audio]'):
+        return 'audio'
+    if name == 'video.mp4' or name.startswith('[video]'):
+        return 'video'
+    if name.endswith('.srt'):
+        return 'captions'
+    if name == 'info.json':
+        return 'info'
+    if name == 'stats.csv':
+        return 'stats'
+    return 'other'
+
+
+def download_state(kinds):
+    if 'combined' in kinds:
+        return 'converted'
+    if 'audio' in kinds and 'video' in kinds:
+        return 'downloaded'
+    if 'audio' in kinds or 'video' in kinds:
+        return 'partial'
+    return 'pending'
+
+
+def scan_dir(path: Path, info: dict = None):
+    """Reads one directory with an info.json into a channel or video record.
+    Returns None if the info.json can't be read.
+    """
+    path = Path(path)
+    if info is None:
+        try:
+            with Path(path, 'info.json').open('r') as infile:
+                info = json.load(infile)
+        except (OSError, ValueError):
+            return None
+    if 'about_html' in info:
+        return {'kind': 'channel', 'path': str(path), 'info': info}
+    if 'url' not in info:
+        return None
+
+    id = video_id(info)
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((entry.name, file_kind(entry.name, id),
+                              stat.st_size, stat.st_mtime))
+    stats = []
+    stats_path = Path(path, 'stats.csv')
+    if stats_path.exists():
+        with stats_path.open('r') as infile:
+            stats = [row for row in csv.DictReader(infile)]
+    return {'kind': 'video', 'path': str(path), 'info': info,
+            'files': files, 'stats': stats}
+
+
+def scan_tree(path: Path):
+    """Returns a record for every channel and video directory under path"""
+    records = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        if 'info.json' in filenames:
+            record = scan_dir(dirpath)
+            if record is not None:
+                records.append(record)
+                if record['kind'] == 'video':
+                    dirnames[:] = []
+    return records
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Catalog:
+    """Index of the local corpus (channels, videos, their files and view
+    statistics) in SQLite.
+
+    Downloading and converting keep it up to date one video at a time, each
+    in a single transaction, so channels and videos can be listed and
+    filtered by channel, publish date or download state without walking
+    Videos/ or parsing info.json files.  rebuild() regenerates it from the
+    directory tree, scanning subtrees in parallel.
+    """
+
+    def __init__(self, path: Path = Path(ROOT_DIR, 'Cache', 'catalog.sqlite')):
+        self.path = Path(path)
+        self.lock = RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version != SCHEMA_VERSION:
+                self._conn.executescript("""
+                    DROP VIEW IF EXISTS streams;
+                    DROP TABLE IF EXISTS stats;
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS videos;
+                    DROP TABLE IF EXISTS channels;
+                """)
+                self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS channels (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    formatted_name TEXT,
+                    fetched_at TEXT,
+                    path TEXT,
+                    info TEXT
+                );
+                -- keyed by path rather than id, since the same video can
+                -- be stored in both the YouTube.py and the yt.py trees
+                CREATE TABLE IF NOT EXISTS videos (
+                    id TEXT NOT NULL,
+                    channel_id TEXT,
+                    title TEXT,
+                    publish_date TEXT,
+                    length REAL,
+                    url TEXT,
+                    state TEXT NOT NULL,
+                    fetched_at TEXT,
+                    path TEXT PRIMARY KEY,
+                    info TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS videos_id ON videos (id);
+                CREATE INDEX IF NOT EXISTS videos_channel_date
+                    ON videos (channel_id, publish_date);
+                CREATE INDEX IF NOT EXISTS videos_state ON videos (state);
+                CREATE TABLE IF NOT EXISTS files (
+                    video_path TEXT NOT NULL
+                        REFERENCES videos (path) ON DELETE CASCADE,
+                    name TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (video_path, name)
+                );
+                CREATE TABLE IF NOT EXISTS stats (
+                    video_path TEXT NOT NULL
+                        REFERENCES videos (path) ON DELETE CASCADE,
+                    timestamp TEXT NOT NULL,
+                    views INTEGER,
+                    rating REAL,
+                    likes INTEGER,
+                    dislikes INTEGER,
+                    PRIMARY KEY (video_path, timestamp)
+                );
+                CREATE VIEW IF NOT EXISTS streams AS
+                    SELECT videos.id AS video_id, video_path, kind, name,
+                           size, mtime
+                    FROM files JOIN videos ON videos.path = files.video_path
+                    WHERE kind IN ('audio', 'video', 'combined');
+            """)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            with self.conn:
+                yield self.conn
+
+    def _write_channel(self, conn, path, info):
+        conn.execute("""
+            INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?)""",
+            (info['id'], info.get('name'), info.get('formatted_name'),
+             info.get('fetched_at'), str(path), json.dumps(info)))
+
+    def _write_video(self, conn, record):
+        info = record['info']
+        id = video_id(info)
+        channel = info.get('channel') or {}
+        # channels are also known from their videos, for trees that have no
+        # channel info.json
+        if channel.get('id'):
+            conn.execute("""
+                INSERT OR IGNORE INTO channels (id, name, formatted_name)
+                VALUES (?, ?, ?)""",
+                (channel['id'], channel.get('name'),
+                 channel.get('formatted_name')))
+        published = info.get('publish_date') or info.get('created_at')
+        if published:
+            published = datetime.fromisoformat(published).isoformat()
+        kinds = set(kind for (_, kind, _, _) in record['files'])
+        path = record['path']
+        conn.execute("DELETE FROM videos WHERE path = ?", (path,))
+        conn.execute("""
+            INSERT INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (id, channel.get('id'), info.get('title'), published,
+             parse_length(info.get('length', info.get('duration'))),
+             info.get('url'), download_state(kinds), info.get('fetched_at'),
+             path, json.dumps(info)))
+        conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                         [(path, *f) for f in record['files']])
+        conn.executemany("""
+            INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?)""",
+            [(path, row.get('timestamp'), to_int(row.get('views')),
+              row.get('rating') or None, to_int(row.get('likes')),
+              to_int(row.get('dislikes'))) for row in record['stats']])
+
+    def add_channel(self, path: Path, info: dict):
+        with self.transaction() as conn:
+            self._write_channel(conn, Path(path).resolve(), info)
+
+    def add_video(self, path: Path, info: dict = None):
+        """(Re)indexes the video stored in path, including whatever files and
+        statistics are currently there.
+        """
+        record = scan_dir(Path(path).resolve(), info)
+        if record is None or record['kind'] != 'video':
+            return
+        with self.transaction() as conn:
+            self._write_video(conn, record)
+
+    def rebuild(self, root: Path = Path(ROOT_DIR, 'Videos'),
+                workers: int = None):
+        """Replaces everything indexed under root with a fresh scan of the
+        directory tree.  Each subdirectory of root is scanned by its own
+        worker process.
+        """
+        root = Path(root).resolve()
+        records = []
+        if Path(root, 'info.json').exists():
+            record = scan_dir(root)
+            if record is not None:
+                records.append(record)
+        if not (records and records[0]['kind'] == 'video'):
+            subdirs = [p for p in root.iterdir() if p.is_dir()] \
+                      if root.exists() else []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for subtree in executor.map(scan_tree, subdirs):
+                    records.extend(subtree)
+
+        prefix = str(root)
+        with self.transaction() as conn:
+            for table in ('videos', 'channels'):
+                conn.execute(f"""
+                    DELETE FROM {table}
+                    WHERE path = ? OR substr(path, 1, ?) = ?""",
+                    (prefix, len(prefix) + 1, prefix + os.sep))
+            for record in records:
+                if record['kind'] == 'channel':
+                    self._write_channel(conn, record['path'], record['info'])
+                else:
+                    self._write_video(conn, record)
+        print(f"[INFO] catalog indexed {len(records)} directories "
+              f"under {root}")
+        return len(records)
+
+    def channels(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM channels ORDER BY name").fetchall()
+        return [self._row(row) for row in rows]
+
+    def channel_at(self, path: Path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM channels WHERE path = ?",
+                (str(Path(path).resolve()),)).fetchone()
+        return self._row(row) if row else None
+
+    def videos(self,
+               channel: str = None,
+               start: datetime = None,
+               end: datetime = None,
+               state: str = None,
+               under: Path = None):
+        """Videos ordered by publish date.  channel may be a channel's id,
+        name or formatted name; start and end bound the publish date
+        (inclusive); state is one of 'pending', 'partial', 'downloaded' or
+        'converted'; under restricts them to videos stored beneath a
+        directory.
+        """
+        query = "SELECT videos.* FROM videos"
+        conditions = []
+        params = []
+        if channel is not None:
+            query += " JOIN channels ON channels.id = videos.channel_id"
+            conditions.append("? IN (channels.id, channels.name, "
+                              "channels.formatted_name)")
+            params.append(channel)
+        if start is not None:
+            conditions.append("videos.publish_date >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            conditions.append("substr(videos.publish_date, 1, ?) <= ?")
+            params.extend([len(end.isoformat()), end.isoformat()])
+        if state is not None:
+            conditions.append("videos.state = ?")
+            params.append(state)
+        if under is not None:
+            prefix = str(Path(under).resolve()) + os.sep
+            conditions.append("substr(videos.path, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY videos.publish_date"
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [self._row(row) for row in rows]
+
+    def files(self, path: Path):
+        """Files in the video directory at path"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM files WHERE video_path = ? ORDER BY name",
+                (str(Path(path).resolve()),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self, path: Path):
+        """View statistics of the video stored at path"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM stats WHERE video_path = ? ORDER BY timestamp",
+                (str(Path(path).resolve()),)).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _row(row):
+        row = dict(row)
+        if row.get('info'):
+            row['info'] = json.loads(row['info'])
+        return row
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __len__(self):
+        with self.lock:
+            (count,) = self.conn.execute(
+                "SELECT COUNT(*) FROM videos").fetchone()
+        return count
+
+
+catalog = Catalog()
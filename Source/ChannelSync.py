@@ -0,0 +1,147 @@
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import sqlite3
+import time
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+
+class SyncStore:
+    """What we already know about each channel's uploads.
+
+    Keeps every video API response seen per channel, along with the newest
+    video id and publish time and whether the channel's whole upload
+    history has been paged through at least once, so that a sync only has
+    to fetch what was uploaded since the last one.
+    """
+
+    def __init__(self, path: Path = Path(ROOT_DIR, 'Cache', 'sync.sqlite')):
+        self.path = Path(path)
+        self.lock = Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # Downloader syncs channels from several processes at once
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS channels (
+                    id TEXT PRIMARY KEY,
+                    newest_id TEXT,
+                    newest_published TEXT,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    synced REAL
+                );
+                CREATE TABLE IF NOT EXISTS uploads (
+                    channel_id TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    published TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    PRIMARY KEY (channel_id, video_id)
+                );
+                CREATE INDEX IF NOT EXISTS uploads_published
+                    ON uploads (channel_id, published);
+            """)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def state(self, channel_id: str):
+        """Returns a dictionary with the channel's newest_id,
+        newest_published, complete and synced fields, or None if it has
+        never been synced.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM channels WHERE id = ?", (channel_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            state = dict(zip([c[0] for c in cursor.description], row))
+        state['complete'] = bool(state['complete'])
+        return state
+
+    def known(self, channel_id: str, video_ids):
+        video_ids = list(video_ids)
+        if not video_ids:
+            return set()
+        marks = ','.join('?' * len(video_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT video_id FROM uploads WHERE channel_id = ? "
+                f"AND video_id IN ({marks})", [channel_id] + video_ids)
+            return set(video_id for (video_id,) in rows)
+
+    def add(self, channel_id: str, responses):
+        """Stores video API responses and moves the channel's newest
+        upload forward, in one transaction.
+        """
+        rows = [(channel_id, r['id'], r['snippet']['publishedAt'],
+                 json.dumps(r)) for r in responses]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)", rows)
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO channels (id) VALUES (?)",
+                    (channel_id,))
+                self.conn.execute("""
+                    UPDATE channels SET
+                        (newest_id, newest_published) = (
+                            SELECT video_id, published FROM uploads
+                            WHERE channel_id = ?
+                            ORDER BY published DESC LIMIT 1),
+                        synced = ?
+                    WHERE id = ?""", (channel_id, time.time(), channel_id))
+
+    def mark_complete(self, channel_id: str):
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO channels (id) VALUES (?)",
+                    (channel_id,))
+                self.conn.execute(
+                    "UPDATE channels SET complete = 1, synced = ? "
+                    "WHERE id = ?", (time.time(), channel_id))
+
+    def responses(self, channel_id: str, limit: int = None):
+        """Stored video API responses for the channel, newest first"""
+        query = ("SELECT response FROM uploads WHERE channel_id = ? "
+                 "ORDER BY published DESC")
+        params = [channel_id]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [json.loads(response) for (response,) in rows]
+
+    def reset(self, channel_id: str):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM uploads WHERE channel_id = ?",
+                                  (channel_id,))
+                self.conn.execute("DELETE FROM channels WHERE id = ?",
+                                  (channel_id,))
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+
+sync_store = SyncStore()
@@ -1,5 +1,6 @@
 import shutil
 
+from Catalog import catalog
 from YouTube import *
 
 
@@ -74,6 +75,7 @@ def fix(channel_path, channel_id):
     for v in tqdm(c.videos, leave = False):
         v.download(dry_run = True, verbose = False)
     fix_off_by_one_day(channel_path)
+    catalog.rebuild(channel_path)    # directories were renamed and merged
 
     ending_videos = len([p for p in channel_path.iterdir() if p.is_dir()])
     print("Ending with %s videos..." % ending_videos)
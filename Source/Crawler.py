@@ -0,0 +1,220 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import asyncio
+import codecs
+import hashlib
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str, base: str = None):
+    """Resolves url against base and puts it in a canonical form (lower
+    case scheme and host, no default port, no fragment, '/' for an empty
+    path), so that the same page is only crawled once.  Returns None for
+    anything that isn't http(s).
+    """
+    if base is not None:
+        url = urljoin(base, url.strip())
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+class LinkParser(HTMLParser):
+    """Collects <a href> targets from HTML fed to it a chunk at a time"""
+
+    def __init__(self, base: str):
+        super().__init__(convert_charrefs=True)
+        self.base = base
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'base':
+            href = dict(attrs).get('href')
+            if href:
+                self.base = urljoin(self.base, href)
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                url = normalize_url(href, self.base)
+                if url is not None:
+                    self.links.append(url)
+
+
+class DirectorySink:
+    """Stores each crawled page as its own file, named by a hash of its
+    url, with an index.tsv of url -> file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def write(self, url: str, chunks):
+        name = hashlib.sha1(url.encode()).hexdigest() + '.html'
+        with Path(self.path, name).open('wb') as outfile:
+            for chunk in chunks:
+                outfile.write(chunk)
+        with Path(self.path, 'index.tsv').open('a') as index:
+            index.write(f"{url}\t{name}\n")
+
+
+class Crawler:
+    """Breadth-first crawler for the pages cited in a video.
+
+    Fetches run on a thread pool through one pooled session, scheduled by
+    asyncio so that no host ever has more than per_host requests in flight
+    or sees them closer together than delay seconds.  Each page is parsed
+    for links as it streams in and handed to sink.write(url, chunks) in the
+    same pass, so whole pages are never held in memory.  The crawl stops
+    after max_depth links from the seeds or max_pages fetches.
+    """
+
+    def __init__(self,
+                 max_depth: int = 1,
+                 max_pages: int = 100,
+                 per_host: int = 2,
+                 delay: float = 1.0,
+                 timeout: float = 10,
+                 workers: int = 8,
+                 same_host: bool = False,
+                 sink=None):
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = timeout
+        self.workers = workers
+        self.same_host = same_host
+        self.sink = sink
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url: str):
+        """Downloads url, returning its status code and the links in it.
+        Runs on a worker thread.
+        """
+        with self.session.get(url, timeout=self.timeout,
+                              stream=True) as response:
+            content_type = response.headers.get('Content-Type', '')
+            if response.status_code >= 400 or 'html' not in content_type:
+                return (response.status_code, [])
+            parser = LinkParser(response.url)
+            try:
+                decoder = codecs.getincrementaldecoder(
+                    response.encoding or 'utf-8')(errors='replace')
+            except LookupError:
+                # the server named a charset Python doesn't know
+                decoder = codecs.getincrementaldecoder('utf-8')(
+                    errors='replace')
+
+            def parse(chunks):
+                for chunk in chunks:
+                    parser.feed(decoder.decode(chunk))
+                    yield chunk
+
+            chunks = parse(response.iter_content(64 * 1024))
+            if self.sink is not None:
+                self.sink.write(url, chunks)
+            for _ in chunks:
+                pass    # whatever the sink didn't read still needs parsing
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+            return (response.status_code, parser.links)
+
+    async def polite(self, host: str):
+        # reserve the next start time for this host before sleeping, so
+        # concurrent requests to it are spaced out rather than bunched
+        async with self.host_lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.delay
+        await asyncio.sleep(start - now)
+
+    async def visit(self, url: str, depth: int):
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.per_host)
+        async with self.hosts[host]:
+            await self.polite(host)
+            loop = asyncio.get_running_loop()
+            try:
+                (status, links) = await loop.run_in_executor(
+                    self.executor, self.fetch, url)
+            except Exception as e:
+                # a bad page (or a failing sink) shouldn't end the crawl
+                print(f"[INFO] could not open {url}: {e}")
+                (status, links) = (None, [])
+        self.visited.append((url, depth, status))
+        if depth < self.max_depth:
+            for link in links:
+                if self.same_host and urlsplit(link).netloc != host:
+                    continue
+                if link not in self.seen:
+                    self.seen.add(link)
+                    self.frontier.append((link, depth + 1))
+
+    async def crawl(self, seeds):
+        self.seen = set()
+        self.frontier = deque()
+        self.visited = []
+        self.hosts = {}
+        self.next_start = {}
+        self.host_lock = asyncio.Lock()
+        for seed in seeds:
+            url = normalize_url(seed)
+            if url is not None and url not in self.seen:
+                self.seen.add(url)
+                self.frontier.append((url, 0))
+
+        scheduled = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as self.executor:
+            while (self.frontier or running):
+                while (self.frontier and len(running) < self.workers and
+                       scheduled < self.max_pages):
+                    (url, depth) = self.frontier.popleft()
+                    running.add(asyncio.ensure_future(self.visit(url, depth)))
+                    scheduled += 1
+                if not running:
+                    break
+                (done, running) = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        return self.visited
+
+    def run(self, seeds):
+        """Crawls from seeds and returns (url, depth, status) for every page
+        fetched, in the order they finished.
+        """
+        return asyncio.run(self.crawl(seeds))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
@@ -0,0 +1,246 @@
+from bisect import bisect_left
+from datetime import timedelta
+from pathlib import Path
+import json
+
+import cv2
+import numpy as np
+
+from VideoReader import Frame, FrameExtractor
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'),
+                        ('offset', '<i8'),
+                        ('length', '<i8')])
+
+
+def parse_timestamp(string: str):
+    """Inverse of str(timedelta), as used in Frame.save() filenames"""
+    days = 0
+    if 'day' in string:
+        (day_part, string) = string.split(', ')
+        days = int(day_part.split(' ')[0])
+    (hours, minutes, seconds) = string.split(':')
+    return timedelta(days=days, hours=int(hours), minutes=int(minutes),
+                     seconds=float(seconds))
+
+
+class FrameArchive:
+    """All the frames saved from one video, in a single file.
+
+    Frames live in frames.bin, next to an index.bin of (timestamp, offset,
+    length) records and an archive.json header.  With encoding='raw' every
+    slot is a fixed-shape uint8 array and reads are zero-copy views of a
+    memory map; with 'jpg' or 'png' each slot holds one encoded image.
+    Frames can be downscaled to a fixed width on the way in, and are
+    appended as they're extracted.
+    """
+
+    def __init__(self,
+                 path: Path,
+                 encoding: str = 'raw',
+                 width: int = None,
+                 quality: int = 95):
+        self.path = Path(path)
+        self.header_path = Path(self.path, 'archive.json')
+        self.data_path = Path(self.path, 'frames.bin')
+        self.index_path = Path(self.path, 'index.bin')
+
+        if self.header_path.exists():
+            with self.header_path.open('r') as infile:
+                header = json.load(infile)
+        else:
+            if encoding not in ('raw', 'jpg', 'png'):
+                raise ValueError(f"Unknown frame encoding: {encoding}")
+            header = {
+                'encoding': encoding,
+                'width': width,
+                'quality': quality,
+                'shape': None
+            }
+        self.encoding = header['encoding']
+        self.width = header['width']
+        self.quality = header['quality']
+        self.shape = tuple(header['shape']) if header['shape'] else None
+
+        if self.index_path.exists():
+            self.index = np.fromfile(str(self.index_path), dtype=INDEX_DTYPE)
+        else:
+            self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.pending = []
+        self._order = None
+        self._data = None
+        self._data_file = None
+        self._index_file = None
+
+    @classmethod
+    def for_video(cls, video_name: str, **kwargs):
+        return cls(Path(ROOT_DIR, 'Frames', video_name, 'archive'), **kwargs)
+
+    def _write_header(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self.header_path.open('w') as outfile:
+            json.dump({
+                'encoding': self.encoding,
+                'width': self.width,
+                'quality': self.quality,
+                'shape': list(self.shape) if self.shape else None
+            }, outfile)
+
+    def _encode(self, image):
+        if self.encoding == 'raw':
+            if image.shape != self.shape:
+                raise ValueError(f"Frame shape {image.shape} does not match "
+                                 f"archive shape {self.shape}")
+            return np.ascontiguousarray(image).tobytes()
+        if self.encoding == 'jpg':
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        (success, encoded) = cv2.imencode('.' + self.encoding, image, params)
+        if not success:
+            raise RuntimeError("Could not encode frame")
+        return encoded.tobytes()
+
+    def append(self, frame: Frame):
+        image = frame.image
+        if self.width and image.shape[1] != self.width:
+            (H, W) = image.shape[:2]
+            height = int(round(H * self.width / float(W)))
+            image = cv2.resize(image, (self.width, height),
+                               interpolation=cv2.INTER_AREA)
+        if self.shape is None:
+            self.shape = image.shape
+            self._write_header()
+        elif not self.header_path.exists():
+            self._write_header()
+
+        if self._data_file is None:
+            self._data_file = self.data_path.open('ab')
+            self._index_file = self.index_path.open('ab')
+        data = self._encode(image)
+        offset = self._data_file.tell()
+        self._data_file.write(data)
+        record = np.array([(frame.timestamp.total_seconds(), offset,
+                            len(data))], dtype=INDEX_DTYPE)
+        self._index_file.write(record.tobytes())
+        self.pending.append(record)
+
+    def flush(self):
+        if self._data_file is not None:
+            self._data_file.flush()
+            self._index_file.flush()
+        if self.pending:
+            self.index = np.concatenate([self.index] + self.pending)
+            self.pending = []
+            self._order = None
+            self._data = None   # remap to pick up the new bytes
+
+    @property
+    def order(self):
+        # frames are normally appended in time order, but don't rely on it
+        if self._order is None:
+            self._order = np.argsort(self.index['timestamp'], kind='stable')
+        return self._order
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.memmap(str(self.data_path), dtype=np.uint8,
+                                   mode='r')
+        return self._data
+
+    def timestamps(self):
+        self.flush()
+        return [timedelta(seconds=t)
+                for t in self.index['timestamp'][self.order]]
+
+    def _read(self, record):
+        (seconds, offset, length) = record
+        raw = self.data[offset:offset + length]
+        if self.encoding == 'raw':
+            image = raw.reshape(self.shape)
+        else:
+            image = cv2.imdecode(np.asarray(raw), cv2.IMREAD_UNCHANGED)
+        return Frame(image, self.path.parents[0].name,
+                     timedelta(seconds=float(seconds)))
+
+    def __getitem__(self, i: int):
+        """Returns the i-th frame in timestamp order"""
+        self.flush()
+        return self._read(self.index[self.order[i]])
+
+    def get(self, timestamp: timedelta, tolerance: timedelta = None):
+        """Returns the frame closest to timestamp, or None if the archive is
+        empty or the closest frame is further than tolerance away.
+        """
+        self.flush()
+        if len(self.index) == 0:
+            return None
+        times = self.index['timestamp'][self.order]
+        target = timestamp.total_seconds()
+        i = bisect_left(times, target)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(times)]
+        best = min(candidates, key=lambda j: abs(times[j] - target))
+        if tolerance is not None and \
+           abs(times[best] - target) > tolerance.total_seconds():
+            return None
+        return self[best]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self.index) + len(self.pending)
+
+    def close(self):
+        self.flush()
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = None
+            self._index_file = None
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    @classmethod
+    def import_pngs(cls, png_dir: Path, archive_path: Path = None, **kwargs):
+        """Builds an archive from an existing Frame.save() dump, i.e. a
+        directory of '<timestamp>.png' files.
+        """
+        png_dir = Path(png_dir)
+        if archive_path is None:
+            archive_path = Path(png_dir, 'archive')
+        dumps = []
+        for png in png_dir.glob('*.png'):
+            try:
+                dumps.append((parse_timestamp(png.stem), png))
+            except ValueError:
+                continue
+        with cls(archive_path, **kwargs) as archive:
+            for (timestamp, png) in sorted(dumps):
+                image = cv2.imread(str(png))
+                archive.append(Frame(image, png_dir.name, timestamp))
+        return cls(archive_path)
+
+
+def archive_video(video_path: Path,
+                  start: timedelta = timedelta(),
+                  stop: timedelta = None,
+                  step: timedelta = timedelta(seconds=10),
+                  **kwargs):
+    """Extracts frames from a video straight into its FrameArchive"""
+    extractor = FrameExtractor(Path(video_path))
+    with FrameArchive.for_video(extractor.video_name, **kwargs) as archive:
+        for frame in extractor.frames(start, stop, step):
+            frame.save(archive=archive)
+        print(f"[INFO] archived {len(archive)} frames to {archive.path}")
+    return FrameArchive.for_video(extractor.video_name)
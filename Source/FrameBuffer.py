@@ -0,0 +1,208 @@
+from datetime import timedelta
+from multiprocessing import Process, Queue, shared_memory
+from pathlib import Path
+import heapq
+import os
+
+import cv2
+import numpy as np
+
+from VideoReader import Frame, FrameExtractor
+
+
+class SharedFrameRing:
+    """Fixed number of frame-sized slots in shared memory, passed between
+    a decoding process and one or more analysis processes.
+
+    The producer blocks until a slot is free (backpressure), copies the
+    frame's pixels into it and sends only a small metadata record
+    (sequence number, slot, video name, timestamp) through a queue.
+    Consumers get Frames whose images are views straight onto the shared
+    slot, and hand the slot back when they move on to the next frame.
+    """
+
+    def __init__(self, slots: int, shape: tuple, dtype=np.uint8):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=self.slot_bytes * slots)
+        self.owner = os.getpid()
+        self.free = Queue()
+        self.filled = Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self._array = None
+
+    def __getstate__(self):
+        # only the segment's name crosses the process boundary
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        state['_array'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # processes started by multiprocessing share the creator's resource
+        # tracker, so attaching here doesn't make us responsible for unlinking
+        self.shm = shared_memory.SharedMemory(name=state['shm'])
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.ndarray((self.slots, *self.shape),
+                                     dtype=self.dtype, buffer=self.shm.buf)
+        return self._array
+
+    def put(self, frame: Frame, sequence: int):
+        if frame.image.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.image.shape} does not "
+                             f"match ring slots {self.shape}")
+        slot = self.free.get()
+        self.array[slot][...] = frame.image
+        self.filled.put((sequence, slot, frame.video_name,
+                         frame.timestamp.total_seconds(), frame.full_size))
+
+    def close_input(self, consumers: int = 1):
+        for _ in range(consumers):
+            self.filled.put(None)
+
+    def frames(self):
+        """Yields (sequence, Frame) pairs until the producer is done.  Each
+        Frame's image is a view onto shared memory that stays valid only
+        until the next frame is requested.
+        """
+        slot = None
+        try:
+            while True:
+                # hand the previous slot back before waiting, otherwise
+                # consumers holding every slot would starve the producer
+                if slot is not None:
+                    self.free.put(slot)
+                    slot = None
+                record = self.filled.get()
+                if record is None:
+                    break
+                (sequence, slot, video_name, seconds, full_size) = record
+                image = self.array[slot]
+                yield (sequence, Frame(image, video_name,
+                                       timedelta(seconds=seconds),
+                                       full_size=tuple(full_size)))
+        finally:
+            if slot is not None:
+                self.free.put(slot)
+
+    def close(self):
+        self._array = None
+        self.shm.close()
+        if os.getpid() == self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+
+def produce(ring: SharedFrameRing, video_path: Path, consumers: int,
+            frame_kwargs: dict, results: Queue):
+    # like consume, finishes by sending None or the exception that stopped
+    # decoding, so a failed decode isn't mistaken for the end of the video
+    error = None
+    try:
+        extractor = FrameExtractor(Path(video_path))
+        for (sequence, frame) in enumerate(extractor.frames(**frame_kwargs)):
+            ring.put(frame, sequence)
+    except Exception as e:
+        error = e
+    finally:
+        ring.close_input(consumers)
+        results.put(error)
+        ring.close()
+
+
+def consume(ring: SharedFrameRing, analyze, results: Queue):
+    # the last thing sent is None when done, or the exception that stopped
+    # this consumer
+    error = None
+    try:
+        for (sequence, frame) in ring.frames():
+            results.put((sequence, frame.timestamp, analyze(frame)))
+    except Exception as e:
+        error = e
+    finally:
+        results.put(error)
+        ring.close()
+
+
+def analyze_video(video_path: Path,
+                  analyze,
+                  consumers: int = None,
+                  slots: int = None,
+                  width: int = None,
+                  **frame_kwargs):
+    """Decodes a video in one process and runs analyze(frame) in consumer
+    processes, with frames passed through a SharedFrameRing rather than
+    pickled.  analyze must be a picklable top level function returning a
+    small picklable result (e.g. boxes or text).
+
+    Yields (timestamp, result) in timestamp order, and re-raises the first
+    exception raised by analyze or while decoding.  frame_kwargs are passed to
+    FrameExtractor.frames(); if width is given, frames are decoded at that
+    width by the ffmpeg backend.
+    """
+    consumers = consumers or max(1, os.cpu_count() - 1)
+    slots = slots or consumers * 2
+    extractor = FrameExtractor(Path(video_path))
+    W = int(extractor.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    H = int(extractor.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width:
+        (W, H) = (width, int(round(H * width / W / 2)) * 2)
+        frame_kwargs.update(backend='ffmpeg', width=width)
+
+    ring = SharedFrameRing(slots, (H, W, 3))
+    results = Queue()
+    workers = [Process(target=consume, args=(ring, analyze, results))
+               for _ in range(consumers)]
+    producer = Process(target=produce,
+                       args=(ring, video_path, consumers, frame_kwargs,
+                             results))
+    for process in workers + [producer]:
+        process.start()
+
+    # results arrive in whatever order consumers finish; put them back in
+    # decode order before yielding.  Every consumer and the producer end
+    # with None (or an exception).
+    running = consumers + 1
+    finished = False
+    try:
+        heap = []
+        next_sequence = 0
+        while running:
+            item = results.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            heapq.heappush(heap, item)
+            while heap and heap[0][0] == next_sequence:
+                (_, timestamp, result) = heapq.heappop(heap)
+                yield (timestamp, result)
+                next_sequence += 1
+        while heap:
+            (_, timestamp, result) = heapq.heappop(heap)
+            yield (timestamp, result)
+        finished = True
+    finally:
+        if not finished:
+            # the caller stopped early or a consumer failed, so nobody may
+            # be left to free the slots the producer is waiting on
+            for process in [producer] + workers:
+                process.terminate()
+        for process in [producer] + workers:
+            process.join()
+        ring.close()
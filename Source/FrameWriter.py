@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+import time
+
+import cv2
+
+CODECS = {
+    # codec: (extension, imwrite parameter, default level)
+    'png': ('png', cv2.IMWRITE_PNG_COMPRESSION, 3),
+    'jpg': ('jpg', cv2.IMWRITE_JPEG_QUALITY, 95),
+    'webp': ('webp', cv2.IMWRITE_WEBP_QUALITY, 95)
+}
+
+
+class FrameWriter:
+    """Writes frames and annotated frames to disk on background threads.
+
+    write() copies the image and returns immediately unless max_pending
+    images are already waiting, in which case it blocks until one has been
+    written (back pressure).  The time spent blocked is recorded, so a
+    writer that can't keep up with the analysis loop shows up in its
+    summary.  close() (or leaving a with block) waits for everything queued
+    to reach disk.
+
+    To use it for Frame.save() and find_text(save_boxes=True), assign it to
+    Frame.writer.
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 max_pending: int = 32,
+                 codec: str = 'png',
+                 level: int = None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        (self.extension, param, default) = CODECS[codec]
+        self.codec = codec
+        self.params = [param, default if level is None else level]
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = BoundedSemaphore(max_pending)
+        self.lock = Lock()
+        self.pending = set()
+        self.errors = []
+
+        self.written = 0
+        self.bytes_written = 0
+        self.blocked = 0
+        self.blocked_time = 0
+        self.write_time = 0
+        self.peak_pending = 0
+
+    def _write(self, path: Path, image):
+        try:
+            start = time.time()
+            path.parents[0].mkdir(parents=True, exist_ok=True)
+            if not cv2.imwrite(str(path), image, self.params):
+                raise OSError(f"Could not write {path}")
+            with self.lock:
+                self.written += 1
+                self.bytes_written += path.stat().st_size
+                self.write_time += time.time() - start
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+        finally:
+            self.slots.release()
+
+    def write(self, path: Path, image):
+        if not self.slots.acquire(blocking=False):
+            start = time.time()
+            self.slots.acquire()
+            self.blocked += 1
+            self.blocked_time += time.time() - start
+        # the caller is free to keep drawing on (or reuse) its image
+        future = self.executor.submit(self._write, Path(path), image.copy())
+        with self.lock:
+            self.pending.add(future)
+            self.peak_pending = max(self.peak_pending, len(self.pending))
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def flush(self):
+        """Waits for every queued image to be written, then raises the first
+        error any of them hit.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.result()
+        with self.lock:
+            (errors, self.errors) = (self.errors, [])
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __str__(self):
+        rate = self.written / self.write_time if self.write_time else 0
+        return (f"[INFO] frame writer: {self.written} {self.codec} images "
+                f"({self.bytes_written / 1024 ** 2:.1f} MB, "
+                f"{rate:.1f} images/s per thread), peak queue "
+                f"{self.peak_pending}, blocked {self.blocked} times for "
+                f"{self.blocked_time:.2f} seconds")
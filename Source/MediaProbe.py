@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+FIELDS = ('duration', 'format', 'video_codec', 'audio_codec', 'width',
+          'height', 'fps', 'keyframes')
+
+
+def probe_file(path: Path, keyframes: bool = False):
+    """Runs ffprobe once on path and returns a dictionary of FIELDS.  The
+    keyframe count needs every video packet to be read, so it's only taken
+    when asked for.  duration is None if ffprobe can't read the file (e.g.
+    a partial download).
+    """
+    info = dict.fromkeys(FIELDS)
+    cmd = ['ffprobe', '-v', 'error',
+           '-show_entries', ('format=duration,format_name:stream=codec_type,'
+                             'codec_name,width,height,avg_frame_rate'),
+           '-of', 'json', str(path)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    try:
+        probed = json.loads(result.stdout)
+        info['duration'] = float(probed['format']['duration'])
+    except (ValueError, KeyError):
+        return info
+    info['format'] = probed['format'].get('format_name')
+    for stream in probed.get('streams', []):
+        if stream.get('codec_type') == 'video' and not info['video_codec']:
+            info['video_codec'] = stream.get('codec_name')
+            info['width'] = stream.get('width')
+            info['height'] = stream.get('height')
+            try:
+                info['fps'] = float(Fraction(stream['avg_frame_rate']))
+            except (KeyError, ValueError, ZeroDivisionError):
+                pass
+        elif stream.get('codec_type') == 'audio' and not info['audio_codec']:
+            info['audio_codec'] = stream.get('codec_name')
+
+    if keyframes and info['video_codec']:
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=flags', '-of', 'csv=p=0', str(path)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        info['keyframes'] = sum('K' in line for line in
+                                result.stdout.decode().splitlines())
+    return info
+
+
+class ProbeCache:
+    """ffprobe results for media files, kept in SQLite and keyed by each
+    file's path, size and modification time, so a file is only ever probed
+    again after it changes.
+    """
+
+    def __init__(self,
+                 path: Path = Path(ROOT_DIR, 'Cache', 'probes.sqlite'),
+                 workers: int = None):
+        self.path = Path(path)
+        self.workers = workers or os.cpu_count()
+        self.lock = Lock()
+        self._conn = None
+        self._pid = None
+
+        self.hits = 0
+        self.probed = 0
+
+    @property
+    def conn(self):
+        # each process (e.g. a Downloader worker) opens its own connection
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS probes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    duration REAL,
+                    format TEXT,
+                    video_codec TEXT,
+                    audio_codec TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    fps REAL,
+                    keyframes INTEGER,
+                    probed REAL NOT NULL
+                )""")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def key(path: Path):
+        path = Path(path).resolve()
+        stat = path.stat()
+        return (str(path), stat.st_size, stat.st_mtime)
+
+    def cached(self, path: Path, keyframes: bool = False):
+        """Returns the stored probe for path if the file hasn't changed
+        since, otherwise None.
+        """
+        (key, size, mtime) = self.key(path)
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT size, mtime, {', '.join(FIELDS)} FROM probes "
+                "WHERE path = ?", (key,)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        info = dict(zip(FIELDS, row[2:]))
+        if keyframes and info['keyframes'] is None and info['video_codec']:
+            return None
+        return info
+
+    def store(self, probes):
+        """Stores a list of (key, info) pairs in one transaction"""
+        rows = [(key, size, mtime, *[info[f] for f in FIELDS], time.time())
+                for ((key, size, mtime), info) in probes]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO probes VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get(self, path: Path, keyframes: bool = False):
+        info = self.cached(path, keyframes)
+        if info is not None:
+            self.hits += 1
+            return info
+        key = self.key(path)
+        info = probe_file(path, keyframes)
+        self.store([(key, info)])
+        self.probed += 1
+        return info
+
+    def get_many(self, paths, keyframes: bool = False):
+        """Returns {path: info} for every existing file in paths, probing
+        the ones that aren't cached yet on a pool of ffprobe workers.
+        """
+        paths = [Path(p) for p in paths if Path(p).exists()]
+        results = {}
+        missing = []
+        for path in paths:
+            info = self.cached(path, keyframes)
+            if info is None:
+                missing.append(path)
+            else:
+                results[path] = info
+        self.hits += len(results)
+        if missing:
+            keys = [self.key(path) for path in missing]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                infos = list(executor.map(
+                    lambda path: probe_file(path, keyframes), missing))
+            self.store(list(zip(keys, infos)))
+            self.probed += len(missing)
+            results.update(zip(missing, infos))
+        return results
+
+    def duration(self, path: Path):
+        """Duration of path in seconds.  Raises ValueError if the file
+        can't be read as media.
+        """
+        seconds = self.get(path)['duration']
+        if seconds is None:
+            raise ValueError(f"Could not read duration of {path}")
+        return seconds
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __str__(self):
+        return (f"[INFO] probe cache: {self.hits} hits, "
+                f"{self.probed} files probed")
+
+
+probe_cache = ProbeCache()
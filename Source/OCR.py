@@ -0,0 +1,356 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from queue import Queue
+import os
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+
+def to_pil(image):
+    """Converts an OpenCV (BGR or grayscale) array into a PIL image"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(image)
+
+
+def binarize(image):
+    """Grayscale + Otsu threshold, flipped if needed so that text ends up
+    dark on a white background regardless of the original colors.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    image = cv2.threshold(image, 0, 255,
+                          cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    if image.mean() < 127:
+        image = 255 - image
+    return image
+
+
+def build_montage(crops, line_height: int = 48, gap: int = 24):
+    """Stacks crops into a single white page, one per line.  Every crop is
+    binarized and rescaled to line_height pixels tall, and lines are spaced
+    gap pixels apart so tesseract doesn't merge them.
+
+    Returns the page and a list of (top, bottom) rows occupied by each crop.
+    """
+    lines = []
+    for crop in crops:
+        (h, w) = crop.shape[:2]
+        width = max(1, int(round(w * line_height / float(max(h, 1)))))
+        lines.append(cv2.resize(binarize(crop), (width, line_height),
+                                interpolation=cv2.INTER_CUBIC))
+
+    width = max(line.shape[1] for line in lines) + 2 * gap
+    height = len(lines) * (line_height + gap) + gap
+    page = np.full((height, width), 255, dtype=np.uint8)
+    slots = []
+    top = gap
+    for line in lines:
+        page[top:top + line_height, gap:gap + line.shape[1]] = line
+        slots.append((top, top + line_height))
+        top += line_height + gap
+    return (page, slots)
+
+
+def assign_words(words, slots, gap: int = 24):
+    """Maps (left, top, width, height, conf, text) words recognized on a
+    montage back to the slot whose rows contain their vertical center.
+    Returns one string per slot, with words joined in reading order.
+    """
+    tops = np.array([top - gap / 2 for (top, _) in slots])
+    per_slot = [[] for _ in slots]
+    for (left, top, width, height, conf, text) in words:
+        center = top + height / 2
+        i = int(np.searchsorted(tops, center, side='right')) - 1
+        if 0 <= i < len(slots):
+            per_slot[i].append((left, text))
+    return [' '.join(text for (_, text) in sorted(line))
+            for line in per_slot]
+
+
+def parse_config(config: str):
+    """Splits a tesseract command line config string into tesseract
+    variables (-c name=value, --dpi) and an engine mode (--oem), for
+    backends that don't run the command line.  Raises ValueError for any
+    other option, so an engine never silently ignores part of its config.
+    """
+    variables = {}
+    oem = None
+    args = config.split()
+    while args:
+        arg = args.pop(0)
+        if arg == '-c' and args and '=' in args[0]:
+            (name, value) = args.pop(0).split('=', 1)
+            variables[name] = value
+        elif arg == '--dpi' and args:
+            variables['user_defined_dpi'] = args.pop(0)
+        elif arg == '--oem' and args:
+            oem = int(args.pop(0))
+        else:
+            raise ValueError(f"Unsupported tesseract option: {arg}")
+    return (variables, oem)
+
+
+class OCREngine:
+    """Base class for tesseract backends.  Recognition runs on a bounded
+    thread pool (every backend here releases the GIL while tesseract works),
+    so workers is the maximum number of concurrent tesseract jobs.
+    """
+
+    def __init__(self,
+                 workers: int = None,
+                 lang: str = 'eng',
+                 psm: int = None,
+                 config: str = ''):
+        self.workers = workers or os.cpu_count()
+        self.lang = lang
+        self.psm = psm
+        self.config = config
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def signature(self):
+        """Identifies everything that affects this engine's output, for use
+        in cache keys.
+        """
+        return f"{type(self).__name__}:{self.lang}:{self.psm}:{self.config}"
+
+    def _recognize(self, image):
+        raise NotImplementedError()
+
+    def _recognize_many(self, images):
+        return [self._recognize(image) for image in images]
+
+    def _recognize_words(self, image):
+        raise NotImplementedError()
+
+    def recognize_words(self, image):
+        """Returns a (left, top, width, height, conf, text) tuple for every
+        word tesseract finds in the image.
+        """
+        return self._recognize_words(image)
+
+    def submit(self, image):
+        return self.executor.submit(self._recognize, image)
+
+    def recognize(self, image):
+        return self._recognize(image)
+
+    def recognize_batch(self, images, batch_size: int = 16):
+        """Recognizes a list of images, returning one string per image"""
+        return list(self.map(images, batch_size))
+
+    def map(self, images, batch_size: int = 16):
+        """Streams text for an iterable of images in input order.  Images are
+        grouped into batches of batch_size, and at most two batches per
+        worker are in flight at once.
+        """
+        pending = deque()
+
+        def submit(batch):
+            pending.append(self.executor.submit(self._recognize_many, batch))
+
+        batch = []
+        for image in images:
+            batch.append(image)
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+            if len(pending) >= self.workers * 2:
+                yield from pending.popleft().result()
+        if batch:
+            submit(batch)
+        while pending:
+            yield from pending.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+
+class TesserocrEngine(OCREngine):
+    """In-process backend.  Keeps one long-lived tesseract API per worker,
+    so models are loaded once and images are handed over as raw bytes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+        super().__init__(*args, **kwargs)
+        (variables, oem) = parse_config(self.config)
+        options = {'lang': self.lang}
+        if self.psm is not None:
+            options['psm'] = self.psm
+        if oem is not None:
+            options['oem'] = tesserocr.OEM(oem)
+        self.apis = Queue()
+        for _ in range(self.workers):
+            api = tesserocr.PyTessBaseAPI(**options)
+            for (name, value) in variables.items():
+                if not api.SetVariable(name, value):
+                    api.End()
+                    raise ValueError(f"Unknown tesseract variable: {name}")
+            self.apis.put(api)
+
+    def _set_image(self, api, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        (height, width) = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        api.SetImageBytes(image.tobytes(), width, height, channels,
+                          width * channels)
+
+    def _recognize(self, image):
+        api = self.apis.get()
+        try:
+            self._set_image(api, image)
+            return api.GetUTF8Text()
+        finally:
+            self.apis.put(api)
+
+    def _recognize_words(self, image):
+        level = tesserocr.RIL.WORD
+        api = self.apis.get()
+        try:
+            self._set_image(api, image)
+            api.Recognize()
+            words = []
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                text = word.GetUTF8Text(level)
+                if not text or not text.strip():
+                    continue
+                (x1, y1, x2, y2) = word.BoundingBox(level)
+                words.append((x1, y1, x2 - x1, y2 - y1,
+                              word.Confidence(level), text.strip()))
+            return words
+        finally:
+            self.apis.put(api)
+
+    def close(self):
+        super().close()
+        while not self.apis.empty():
+            self.apis.get().End()
+
+
+class TesseractEngine(OCREngine):
+    """Command line backend.  Each batch is packed into a multi-page TIFF in
+    memory and piped through a single tesseract process, which prints one
+    form-feed-separated page of text per image.  This pays for one process
+    start and model load per batch rather than per image, and never touches
+    the disk.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if shutil.which('tesseract') is None:
+            raise RuntimeError("tesseract executable not found on PATH")
+        super().__init__(*args, **kwargs)
+
+    def _command(self):
+        cmd = ['tesseract', 'stdin', 'stdout', '-l', self.lang]
+        if self.psm is not None:
+            cmd.extend(['--psm', str(self.psm)])
+        cmd.extend(self.config.split())
+        return cmd
+
+    def _run(self, images, configfiles: list = None):
+        pages = [to_pil(image) for image in images]
+        buffer = BytesIO()
+        pages[0].save(buffer, format='TIFF', save_all=True,
+                      append_images=pages[1:])
+        result = subprocess.run(self._command() + (configfiles or []),
+                                input=buffer.getvalue(),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError("tesseract failed: %s" %
+                               result.stderr.decode(errors='replace'))
+        return result.stdout.decode('utf-8')
+
+    def _recognize(self, image):
+        return self._recognize_many([image])[0]
+
+    def _recognize_words(self, image):
+        rows = self._run([image], ['tsv']).splitlines()
+        header = rows[0].split('\t')
+        words = []
+        for row in rows[1:]:
+            record = dict(zip(header, row.split('\t')))
+            text = record.get('text', '').strip()
+            if record['level'] != '5' or not text:
+                continue
+            words.append((int(record['left']), int(record['top']),
+                          int(record['width']), int(record['height']),
+                          float(record['conf']), text))
+        return words
+
+    def _recognize_many(self, images):
+        texts = self._run(images).split('\f')
+        if len(texts) < len(images):
+            # separator got lost somewhere (e.g. custom page_separator),
+            # so fall back to one process per image
+            return [self._recognize_many([i])[0] for i in images]
+        return texts[:len(images)]
+
+
+class PytesseractEngine(OCREngine):
+    """Fallback backend: one pytesseract.image_to_string call per image"""
+
+    def _config(self):
+        if self.psm is not None:
+            return f"--psm {self.psm} {self.config}".strip()
+        return self.config
+
+    def _recognize(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang,
+                                           config=self._config())
+
+    def _recognize_words(self, image):
+        data = pytesseract.image_to_data(image, lang=self.lang,
+                                         config=self._config(),
+                                         output_type=pytesseract.Output.DICT)
+        words = []
+        for i in range(len(data['text'])):
+            text = str(data['text'][i]).strip()
+            if int(data['level'][i]) != 5 or not text:
+                continue
+            words.append((data['left'][i], data['top'][i],
+                          data['width'][i], data['height'][i],
+                          float(data['conf'][i]), text))
+        return words
+
+
+BACKENDS = {
+    'tesserocr': TesserocrEngine,
+    'tesseract': TesseractEngine,
+    'pytesseract': PytesseractEngine
+}
+
+
+def get_engine(backend: str = None, **kwargs):
+    """Returns an OCREngine for the given backend name.  If no backend is
+    given, the fastest available one is chosen: tesserocr, then batched
+    tesseract, then pytesseract.
+    """
+    if backend is not None:
+        return BACKENDS[backend](**kwargs)
+    if tesserocr is not None:
+        return TesserocrEngine(**kwargs)
+    if shutil.which('tesseract') is not None:
+        return TesseractEngine(**kwargs)
+    return PytesseractEngine(**kwargs)
@@ -0,0 +1,172 @@
+from pathlib import Path
+from threading import Lock
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+
+class ResultCache:
+    """Content-addressed store for detection and OCR results.
+
+    Entries are keyed by a hash of the input pixels together with whatever
+    model and parameters produced them, so reruns and parameter sweeps only
+    pay for combinations that haven't been seen before.  The cache is
+    bounded to max_bytes of stored values and evicts least recently used
+    entries first.
+    """
+
+    def __init__(self,
+                 path: Path = Path(ROOT_DIR, 'Cache', 'results.sqlite'),
+                 max_bytes: int = 512 * 1024 ** 2):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def key(image, kind: str, **params):
+        """Returns the cache key for the given image (any numpy array),
+        result kind and producing parameters.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str(image.shape).encode())
+        digest.update(str(image.dtype).encode())
+        digest.update(memoryview(image if image.flags['C_CONTIGUOUS']
+                                 else image.copy()).cast('B'))
+        digest.update(kind.encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    @property
+    def conn(self):
+        # sqlite connections can't cross a fork, so each process (e.g. a
+        # TextDetectionPool worker) opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # the stored size is kept in a one-row table that triggers update
+            # in the same transaction as every write, so all processes see
+            # the same exact total without summing the table
+            self._conn.executescript("""
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_accessed
+                    ON entries (accessed);
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO totals
+                    SELECT 0, COALESCE(SUM(size), 0) FROM entries;
+                CREATE TRIGGER IF NOT EXISTS entries_insert
+                    AFTER INSERT ON entries BEGIN
+                    UPDATE totals SET bytes = bytes + NEW.size;
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_update
+                    AFTER UPDATE OF size ON entries BEGIN
+                    UPDATE totals SET bytes = bytes - OLD.size + NEW.size;
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_delete
+                    AFTER DELETE ON entries BEGIN
+                    UPDATE totals SET bytes = bytes - OLD.size;
+                END;
+                COMMIT;
+            """)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+                              (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, value):
+        encoded = json.dumps(value)
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO entries VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value,
+                    size = excluded.size, accessed = excluded.accessed""",
+                (key, encoded, len(encoded), time.time()))
+            self.conn.commit()
+            self.evict()
+
+    def total_bytes(self):
+        (total,) = self.conn.execute(
+            "SELECT bytes FROM totals WHERE id = 0").fetchone()
+        return total
+
+    def evict(self):
+        # drop least recently used entries until we're back under budget.
+        # The write lock is taken up front so workers evicting at the same
+        # time don't each free the same excess.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            excess = self.total_bytes() - self.max_bytes
+            victims = []
+            if excess > 0:
+                rows = self.conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed")
+                freed = 0
+                for (key, size) in rows:
+                    if freed >= excess:
+                        break
+                    victims.append((key,))
+                    freed += size
+            self.conn.executemany("DELETE FROM entries WHERE key = ?",
+                                  victims)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __len__(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return (f"[INFO] result cache: {self.hits} hits, {self.misses} "
+                f"misses ({rate:.1f}% hit rate), "
+                f"{self.total_bytes() / 1024 ** 2:.1f} MB stored")
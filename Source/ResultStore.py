@@ -0,0 +1,250 @@
+from datetime import timedelta
+from pathlib import Path
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+COLUMNS = ('timestamp', 'startX', 'startY', 'endX', 'endY', 'confidence',
+           'text')
+
+# detection-only runs (FrameExtractor.find_text) and OCR runs (read_text)
+# keep separate records and checkpoints
+KINDS = ('detect', 'text')
+SCHEMA_VERSION = 2
+
+
+class ResultStore:
+    """Per-frame detection and OCR records for every processed video.
+
+    Each frame is written in one transaction together with the video's
+    checkpoint (the last timestamp fully processed by that kind of run), so
+    an interrupted run can pick up exactly where it stopped.  Reads stream from a cursor in
+    batches, or come back as one numpy array per column, without holding
+    more than the requested range in memory.
+    """
+
+    def __init__(self, path: Path = Path(ROOT_DIR, 'Cache', 'results.db')):
+        self.path = Path(path)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            tables = [name for (name,) in self._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")]
+            if version < SCHEMA_VERSION and 'checkpoints' in tables:
+                self._migrate()
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS detections (
+                    video TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    startX INTEGER NOT NULL,
+                    startY INTEGER NOT NULL,
+                    endX INTEGER NOT NULL,
+                    endY INTEGER NOT NULL,
+                    confidence REAL NOT NULL,
+                    text TEXT
+                );
+                CREATE INDEX IF NOT EXISTS detections_video_kind_timestamp
+                    ON detections (video, kind, timestamp);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    video TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (video, kind)
+                );
+            """)
+            self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _migrate(self):
+        # stores from before runs were split by kind: a video with any OCR
+        # text came from read_text, anything else from find_text
+        self._conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TEMP TABLE ocr_videos AS
+                SELECT DISTINCT video FROM detections WHERE text IS NOT NULL;
+            ALTER TABLE detections RENAME TO detections_v1;
+            CREATE TABLE detections (
+                video TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                startX INTEGER NOT NULL,
+                startY INTEGER NOT NULL,
+                endX INTEGER NOT NULL,
+                endY INTEGER NOT NULL,
+                confidence REAL NOT NULL,
+                text TEXT
+            );
+            INSERT INTO detections
+                SELECT video,
+                       CASE WHEN video IN ocr_videos THEN 'text'
+                            ELSE 'detect' END,
+                       timestamp, startX, startY, endX, endY, confidence, text
+                FROM detections_v1 ORDER BY rowid;
+            DROP TABLE detections_v1;
+            ALTER TABLE checkpoints RENAME TO checkpoints_v1;
+            CREATE TABLE checkpoints (
+                video TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (video, kind)
+            );
+            INSERT INTO checkpoints
+                SELECT video,
+                       CASE WHEN video IN ocr_videos THEN 'text'
+                            ELSE 'detect' END,
+                       timestamp, updated
+                FROM checkpoints_v1;
+            DROP TABLE checkpoints_v1;
+            DROP TABLE ocr_videos;
+            COMMIT;
+        """)
+
+    def add(self, video: str, timestamp: timedelta, boxes, confidences,
+            texts=None, kind: str = None):
+        """Records one processed frame (which may have no boxes at all) and
+        moves the video's checkpoint for this kind of run up to its
+        timestamp.  kind defaults to 'text' if texts are given, otherwise
+        'detect'.
+        """
+        kind = kind or ('detect' if texts is None else 'text')
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind of run: {kind}")
+        seconds = timestamp.total_seconds()
+        if texts is None:
+            texts = [None] * len(boxes)
+        rows = [(video, kind, seconds, int(bb.startX), int(bb.startY),
+                 int(bb.endX), int(bb.endY), float(confidence), text)
+                for (bb, confidence, text) in zip(boxes, confidences, texts)]
+        with self.conn:
+            # re-processing a frame (e.g. after a crash between frames)
+            # replaces its earlier records instead of duplicating them
+            self.conn.execute(
+                "DELETE FROM detections WHERE video = ? AND kind = ? "
+                "AND timestamp = ?", (video, kind, seconds))
+            self.conn.executemany(
+                "INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            self.conn.execute("""
+                INSERT INTO checkpoints VALUES (?, ?, ?, ?)
+                ON CONFLICT(video, kind) DO UPDATE SET
+                    timestamp = MAX(timestamp, excluded.timestamp),
+                    updated = excluded.updated""",
+                (video, kind, seconds, time.time()))
+
+    def checkpoint(self, video: str, kind: str = 'text'):
+        """Returns the last timestamp processed for video by this kind of
+        run, or None
+        """
+        row = self.conn.execute(
+            "SELECT timestamp FROM checkpoints WHERE video = ? AND kind = ?",
+            (video, kind)).fetchone()
+        return timedelta(seconds=row[0]) if row else None
+
+    def resume_from(self, video: str, start: timedelta, step: timedelta,
+                    kind: str = 'text'):
+        """Returns where a run over [start, ...) at this step should begin,
+        skipping everything already checkpointed for this kind of run.
+        """
+        checkpoint = self.checkpoint(video, kind)
+        if checkpoint is None or checkpoint < start:
+            return start
+        return start + ((checkpoint - start) // step + 1) * step
+
+    def reset(self, video: str, kind: str = None):
+        """Forgets video's records and checkpoint for one kind of run, or
+        for all of them
+        """
+        condition = "video = ?" if kind is None else "video = ? AND kind = ?"
+        params = (video,) if kind is None else (video, kind)
+        with self.conn:
+            self.conn.execute(f"DELETE FROM detections WHERE {condition}",
+                              params)
+            self.conn.execute(f"DELETE FROM checkpoints WHERE {condition}",
+                              params)
+
+    def _select(self, columns, video, start, stop, text, kind):
+        query = (f"SELECT {', '.join(columns)} FROM detections "
+                 "WHERE video = ?")
+        params = [video]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start.total_seconds())
+        if stop is not None:
+            query += " AND timestamp <= ?"
+            params.append(stop.total_seconds())
+        if text is not None:
+            query += " AND text LIKE ?"
+            params.append(f"%{text}%")
+        return self.conn.execute(query + " ORDER BY timestamp, rowid", params)
+
+    def records(self,
+                video: str,
+                start: timedelta = None,
+                stop: timedelta = None,
+                text: str = None,
+                batch_size: int = 1000,
+                kind: str = None):
+        """Yields one dictionary per box, streamed in batches"""
+        cursor = self._select(COLUMNS, video, start, stop, text, kind)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+
+    def columns(self,
+                video: str,
+                start: timedelta = None,
+                stop: timedelta = None,
+                text: str = None,
+                kind: str = None):
+        """Returns a dictionary of numpy arrays, one per column"""
+        rows = self._select(COLUMNS, video, start, stop, text,
+                            kind).fetchall()
+        dtypes = (np.float64, np.int32, np.int32, np.int32, np.int32,
+                  np.float32, object)
+        values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        return {column: np.array(value, dtype=dtype)
+                for (column, value, dtype) in zip(COLUMNS, values, dtypes)}
+
+    def videos(self):
+        return [video for (video,) in self.conn.execute(
+            "SELECT DISTINCT video FROM checkpoints ORDER BY video")]
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __len__(self):
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM detections").fetchone()
+        return count
@@ -1,143 +1,130 @@
-import requests
+from collections import deque
+from datetime import timedelta
 from multiprocessing import Pool
+from pathlib import Path
+from urllib.parse import urlsplit
+import hashlib
+import os
+import re
 
-import cv2
-from bs4 import BeautifulSoup
-import pytesseract
-
-
-def dhash(image, hash_size=8):
-    resized = cv2.resize(image, hash_size + 1, hash_size)
-    diff = resized[:, 1:] > resized[:, :-1]
-    return sum([2 ** i for (i, v) in enumerate(diff.flatten()) if v])
+from BlobStore import BlobStore
+from Crawler import Crawler
+from OCR import binarize
+from URLValidator import URLValidator
+from VideoReader import Frame, FrameExtractor
 
 
 class SourceExtractor:
 
-    def __init__(self, path_to_video):
+    shared_validator = None     # one verdict cache and pool for all videos
+    blobs = BlobStore()
+
+    def __init__(self, path_to_video, validator=None):
         self.path = path_to_video
-        self.video = cv2.VideoCapture(path_to_video)
+        self.extractor = FrameExtractor(Path(path_to_video))
+        self.ocr = Frame.load_ocr_engine()     # shared, not one per video
+        if validator is None:
+            if SourceExtractor.shared_validator is None:
+                SourceExtractor.shared_validator = URLValidator()
+            validator = SourceExtractor.shared_validator
+        self.validator = validator
 
     def get_longest_string(self, strings):
         return max(strings, key=lambda s: len(s)).strip()
 
-    def extract_text_by_time(self, x=None, w=None, y=None, h=None, rate=10):
-        def get_frame(time):
-            self.video.set(cv2.CAP_PROP_POS_MSEC, time)
-            (capture_success, frame) = self.video.read()
-            return (capture_success, frame)
-
-        ignore_rows = True
-        ignore_columns = True
+    def crop(self, frame, x=None, w=None, y=None, h=None):
+        search = frame
         if y is not None and h is not None:
-            ignore_rows = False
+            search = search[y:y+h, :]
         if x is not None and w is not None:
-            ignore columns = False
-
-        contents = []
-        time = 0
-        (capture_success, frame) = get_frame(time)
-        while capture_success:
-            search = frame
-            if not ignore_rows and not ignore_columns:
-                search = frame[y:y+h, x:x+w]
-            elif not ignore_rows and ignore_columns:
-                search = frame[y:y+h, :]
-            elif ignore_rows and not ignore_columns:
-                search = frame[: , x:x+w]
-
-            #cv2.imwrite('frame%.png' % (time // 1000), search)
-            image_to_text = pytesseract.image_to_string(search, lang='eng')
-            contents.append(image_to_text)
-        return contents
+            search = search[:, x:x+w]
+        return search
+
+    def stream_text(self, x=None, w=None, y=None, h=None, rate=10,
+                    backend=None, batch_size=16):
+        """Yields (timestamp, text) for a fixed region of the video (e.g. a
+        browser's URL bar), one sampled frame at a time.  The region is
+        binarized before OCR, and crops whose binarized pixels are identical
+        to the last one read are skipped, so each distinct text is yielded
+        once when it first appears.  Crops are recognized batch_size at a
+        time through the OCR engine's map().
+        """
+        timestamps = deque()
+
+        def strips():
+            previous = None
+            for frame in self.extractor.frames(step=timedelta(seconds=rate),
+                                               backend=backend):
+                strip = binarize(self.crop(frame.image, x, w, y, h))
+                digest = hashlib.blake2b(strip.tobytes(),
+                                         digest_size=16).digest()
+                if digest == previous:
+                    continue
+                previous = digest
+                timestamps.append(frame.timestamp)
+                yield strip
+
+        # map() pulls strips in order, so each text matches the oldest
+        # timestamp not yet yielded
+        for text in self.ocr.map(strips(), batch_size):
+            yield (timestamps.popleft(), text)
 
-    def extract_text_by_grab(self, x=None, w=None, y=None, h=None, rate=10):
-        ignore_rows = True
-        ignore_columns = True
-        if y is not None and h is not None:
-            ignore_rows = False
-        if x is not None and w is not None:
-            ignore columns = False
-
-        contents = []
-        prev_time = -1
-        while True:
-            grabbed = self.video.grab()
-            if grabbed:
-                time_s = self.video.get(cv2.CAP_PROP_POS_MSEC) // (rate * 1000)
-                if time_s > prev_time:
-                    (capture_success, frame) = video.retrieve()
-                    search = frame
-                    if not ignore_rows and not ignore_columns:
-                        search = frame[y:y+h, x:x+w]
-                    elif not ignore_rows and ignore_columns:
-                        search = frame[y:y+h, :]
-                    elif ignore_rows and not ignore_columns:
-                        search = frame[: , x:x+w]
-
-                    image_to_text = pytesseract.image_to_string(search,
-                                                                lang='eng')
-                    contents.append(image_to_text)
-                prev_time = time_s
-            else:
-                break
-        return contents
+    def extract_text_by_time(self, x=None, w=None, y=None, h=None, rate=10):
+        return [text for (_, text) in
+                self.stream_text(x, w, y, h, rate, backend='time')]
 
-    def extract_sources(self, rate=10):
-        snapshots = self.extract_text_by_time(y=0, h=32, rate=rate)
-        tried = []
-        output = []
-        for text in snapshots:
+    def extract_text_by_grab(self, x=None, w=None, y=None, h=None, rate=10):
+        return [text for (_, text) in
+                self.stream_text(x, w, y, h, rate, backend='grab')]
+
+    def candidate_urls(self, rate=10):
+        """Yields (timestamp, url) for every distinct URL-like string read
+        off the video's URL bar.
+        """
+        seen = set()
+        for (timestamp, text) in self.stream_text(y=0, h=32, rate=rate):
+            if not text.strip():
+                continue
             search = self.get_longest_string(text.split(' '))
             if not search.startswith('http'):
-                search = 'http://%s' % text
-            if search not in tried:
-                tried.append(search)
-                try:
-                    request = requests.head(search)
-                    if request.status_code < 400:
-                        output.append(search)
-                except:
-                    pass
-        return output
+                search = 'http://%s' % search
+            if search not in seen:
+                seen.add(search)
+                yield (timestamp, search)
+
+    def stream_sources(self, rate=10):
+        """Yields (timestamp, url) for every reachable URL read off the
+        video's URL bar, as soon as it is found.  URLs are checked
+        concurrently while OCR carries on.
+        """
+        candidates = self.candidate_urls(rate)
+        for (timestamp, url, valid) in self.validator.stream(candidates):
+            if valid:
+                yield (timestamp, url)
+        print(self.validator)
+
+    def extract_sources(self, rate=10):
+        return [url for (_, url) in self.stream_sources(rate)]
 
     def save_url(self, url):
-        #https://programminghistorian.org/en/lessons/working-with-web-pages
-        #https://docs.python.org/3/library/http.client.html#http.client.HTTPResponse.read
-        #https://requests.readthedocs.io/en/latest/api/#requests.Response.content
-        (download_dir, _) = os.path.split(self.path)
-        response = requests.get(url)
-        #title = BeautifulSoup.find('.//title').text
-        #if not title:
-        #    title = url
-        #path = os.path.join(download_dir, title)
-        path = os.path.join(download_dir, url)
-        with open(path, 'wb') as f:
-            f.write(response.content)
-
-    def crawl(pages, depth=None):
-        indexed_url = [] # a list for the main and sub-HTML websites in the main website
-        for i in range(depth):
-            for page in pages:
-                if page not in indexed_url:
-                    indexed_url.append(page)
-                    try:
-                        c = requests.get(page)
-                    except:
-                        print( "Could not open %s" % page)
-                        continue
-                    soup = BeautifulSoup(c.read())
-                    links = soup('a') # finding all the sub_links
-                    for link in links:
-                        if 'href' in dict(link.attrs):
-                            url = urljoin(page, link['href'])
-                            if url.find("'") != -1:
-                                    continue
-                            url = url.split('#')[0]
-                            if url[0:4] == 'http':
-                                    indexed_url.append(url)
-            pages = indexed_url
-        return indexed_url
+        """Downloads url into the shared blob store and links it into a
+        Sources directory next to the video.  Returns the linked path.
+        """
+        blob = self.blobs.fetch(url)
+        parts = urlsplit(url)
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_',
+                      (parts.netloc + parts.path).strip('/'))[:100]
+        # distinct urls can flatten to the same name
+        name = '%s.%s' % (name, blob[:12])
+        dest_path = Path(self.path).parents[0] / 'Sources' / name
+        return self.blobs.link(blob, dest_path)
+
+    def crawl(self, pages, depth=1, sink=None, **kwargs):
+        """Crawls outwards from pages, breadth first, and returns every url
+        fetched.  Extra keyword arguments are passed to Crawler.
+        """
+        with Crawler(max_depth=depth, sink=sink, **kwargs) as crawler:
+            return [url for (url, _, _) in crawler.run(pages)]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+from datetime import timedelta
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from VideoReader import FrameExtractor, read_text
+
+
+def signature(image, width: int = 32):
+    """Tiny grayscale thumbnail used to tell whether a region has changed"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    (H, W) = image.shape[:2]
+    size = (width, max(1, int(round(H * width / float(max(W, 1))))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA) \
+              .astype(np.int16)
+
+
+def difference(sig1, sig2):
+    """Mean absolute difference between two signatures, from 0 to 1"""
+    if sig1.shape != sig2.shape:
+        return 1.0
+    return float(np.abs(sig1 - sig2).mean()) / 255
+
+
+class TextTrack:
+
+    def __init__(self, box, confidence: float, timestamp: timedelta,
+                 region_signature):
+        self.box = box
+        self.confidence = confidence
+        self.text = ''
+        self.start = timestamp
+        self.end = timestamp
+        self.signature = region_signature
+
+    def flatten(self):
+        """Returns a json serializable dictionary encapsulating the track"""
+        return {
+            'start' : self.start.total_seconds(),
+            'end' : self.end.total_seconds(),
+            'box' : [self.box.startX, self.box.startY,
+                     self.box.endX, self.box.endY],
+            'confidence' : self.confidence,
+            'text' : self.text
+        }
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"[{self.start} - {self.end}] {self.text}"
+
+
+class TextTracker:
+    """Carries detected text boxes forward between frames.
+
+    Full EAST detection only runs every detect_every frames, or sooner if
+    the frame as a whole or any tracked region changes by more than
+    change_threshold.  After a detection, boxes that overlap an existing
+    track (IoU >= iou_threshold) over unchanged pixels extend that track
+    and keep its text; only genuinely new boxes are sent to OCR.
+    """
+
+    def __init__(self,
+                 detect_every: int = 10,
+                 change_threshold: float = 0.05,
+                 iou_threshold: float = 0.5,
+                 min_confidence: float = 0.8,
+                 padding: float = 0.1,
+                 engine=None):
+        self.detect_every = detect_every
+        self.change_threshold = change_threshold
+        self.iou_threshold = iou_threshold
+        self.min_confidence = min_confidence
+        self.padding = padding
+        self.engine = engine
+
+        self.active = []
+        self.finished = []
+        self.frame_signature = None
+        self.since_detection = None
+        self.detections = 0
+        self.frames_seen = 0
+
+    def region_signature(self, frame, box):
+        return signature(frame.crop(box, padding=0))
+
+    def needs_detection(self, frame, frame_signature):
+        if self.since_detection is None:
+            return True
+        if self.since_detection + 1 >= self.detect_every:
+            return True
+        if (difference(frame_signature, self.frame_signature) >
+            self.change_threshold):
+            return True
+        for track in self.active:
+            current = self.region_signature(frame, track.box)
+            if difference(current, track.signature) > self.change_threshold:
+                return True
+        return False
+
+    def detect(self, frame):
+        (results, confidences) = frame.find_text(self.min_confidence)
+        self.detections += 1
+        continued = []
+        new = []
+        unmatched = list(self.active)
+        for (box, confidence) in zip(results, confidences):
+            region = self.region_signature(frame, box)
+            best = None
+            best_iou = self.iou_threshold
+            for track in unmatched:
+                iou = box.iou(track.box)
+                if (iou >= best_iou and
+                    difference(region, track.signature) <=
+                    self.change_threshold):
+                    (best, best_iou) = (track, iou)
+            if best is not None:
+                unmatched.remove(best)
+                best.end = frame.timestamp
+                continued.append(best)
+            else:
+                new.append(TextTrack(box, confidence, frame.timestamp,
+                                     region))
+
+        # anything that wasn't re-detected has ended
+        self.finished.extend(unmatched)
+        if new:
+            boxes = [track.box for track in new]
+            confidences = [track.confidence for track in new]
+            detections = [(frame, boxes, confidences)]
+            for (_, _, _, texts) in read_text(detections, self.engine,
+                                              self.padding):
+                for (track, text) in zip(new, texts):
+                    track.text = text
+        self.active = continued + new
+
+    def update(self, frame):
+        """Processes the next frame and returns the currently active tracks"""
+        self.frames_seen += 1
+        frame_signature = signature(frame.full_image(), width=64)
+        if self.needs_detection(frame, frame_signature):
+            self.detect(frame)
+            self.frame_signature = frame_signature
+            self.since_detection = 0
+        else:
+            for track in self.active:
+                track.end = frame.timestamp
+            self.since_detection += 1
+        return self.active
+
+    def track(self, frames):
+        """Runs the tracker over a stream of frames and returns every track,
+        ordered by start time.
+        """
+        for frame in frames:
+            self.update(frame)
+        print(self)
+        return self.tracks()
+
+    def tracks(self):
+        return sorted(self.finished + self.active, key=lambda t: t.start)
+
+    def __str__(self):
+        skipped = self.frames_seen - self.detections
+        return (f"[INFO] text tracker ran EAST on {self.detections} of "
+                f"{self.frames_seen} frames ({skipped} skipped), "
+                f"{len(self.finished) + len(self.active)} tracks")
+
+
+def track_video(video_path: Path,
+                start: timedelta = timedelta(),
+                stop: timedelta = None,
+                step: timedelta = timedelta(seconds=1),
+                **kwargs):
+    extractor = FrameExtractor(Path(video_path))
+    tracker = TextTracker(**kwargs)
+    return tracker.track(extractor.frames(start, stop, step))
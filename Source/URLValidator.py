@@ -0,0 +1,178 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+import os
+import sqlite3
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+# some servers refuse HEAD outright; these get a second try with GET
+HEAD_REFUSED = {400, 403, 405, 501}
+
+
+class URLValidator:
+    """Checks whether URLs resolve, many at a time.
+
+    Requests go through one pooled session from a thread pool, with at most
+    per_host requests in flight to any one host.  Verdicts are stored in
+    SQLite and reused across videos until they expire: successes after ttl,
+    failures (which are often transient) after failed_ttl.
+    """
+
+    def __init__(self,
+                 workers: int = 16,
+                 per_host: int = 4,
+                 timeout: float = 10,
+                 ttl: timedelta = timedelta(days=7),
+                 failed_ttl: timedelta = timedelta(hours=6),
+                 path: Path = Path(ROOT_DIR, 'Cache', 'urls.sqlite')):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self.path = Path(path)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.hosts = {}
+        self.lock = Lock()
+        self._conn = None
+        self._pid = None
+
+        self.hits = 0
+        self.checked = 0
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parents[0].mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS verdicts (
+                    url TEXT PRIMARY KEY,
+                    valid INTEGER NOT NULL,
+                    status INTEGER,
+                    checked REAL NOT NULL
+                )""")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def cached(self, url: str):
+        """Returns the stored verdict for url, or None if there isn't a
+        current one.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT valid, checked FROM verdicts WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        (valid, checked) = row
+        ttl = self.ttl if valid else self.failed_ttl
+        if time.time() - checked > ttl.total_seconds():
+            return None
+        return bool(valid)
+
+    def store(self, url: str, valid: bool, status: int = None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (url, int(valid), status, time.time()))
+            self.conn.commit()
+
+    def host_slots(self, url: str):
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def request(self, url: str):
+        """Returns the status code url resolves to (following redirects), or
+        None if it couldn't be reached at all.
+        """
+        with self.host_slots(url):
+            try:
+                response = self.session.head(url, timeout=self.timeout,
+                                             allow_redirects=True)
+                if response.status_code in HEAD_REFUSED:
+                    # only the status line is needed, not the body
+                    with self.session.get(url, timeout=self.timeout,
+                                          allow_redirects=True,
+                                          stream=True) as response:
+                        pass
+                return response.status_code
+            except (requests.RequestException, ValueError):
+                return None
+
+    def is_valid(self, url: str):
+        valid = self.cached(url)
+        if valid is not None:
+            with self.lock:
+                self.hits += 1
+            return valid
+        status = self.request(url)
+        valid = status is not None and status < 400
+        self.store(url, valid, status)
+        with self.lock:
+            self.checked += 1
+        return valid
+
+    def stream(self, items, max_pending: int = None):
+        """Validates (tag, url) pairs from any iterable, which may itself be
+        a slow generator, and yields (tag, url, valid) as each check
+        completes.
+        """
+        max_pending = max_pending or self.workers * 2
+        pending = {}
+        for (tag, url) in items:
+            pending[self.executor.submit(self.is_valid, url)] = (tag, url)
+            while len(pending) >= max_pending:
+                (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield (*pending.pop(future), future.result())
+            # don't hold back results that are already in while the caller
+            # keeps feeding us
+            for future in [f for f in pending if f.done()]:
+                yield (*pending.pop(future), future.result())
+        while pending:
+            (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield (*pending.pop(future), future.result())
+
+    def validate(self, urls):
+        """Returns a dictionary of url: valid"""
+        urls = list(dict.fromkeys(urls))
+        return {url: valid for (_, url, valid) in
+                self.stream((url, url) for url in urls)}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+    def __str__(self):
+        return (f"[INFO] url validator: {self.checked} checked, "
+                f"{self.hits} cached verdicts reused")
@@ -1,17 +1,256 @@
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+from fractions import Fraction
 from pathlib import Path
 import csv
+import json
+import os
+import shutil
+import subprocess
+import tempfile
 import time
 
-from imutils.object_detection import non_max_suppression
+from imutils import object_detection
 import numpy as np
 import cv2
-import pytesseract
+
+from OCR import assign_words, build_montage, get_engine
+from ResultCache import ResultCache
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 SOURCE_DIR = Path(__file__).resolve().parents[0]
 
 
+EAST_LAYER_NAMES = [
+    "feature_fusion/Conv_7/Sigmoid",
+    "feature_fusion/concat_3"]
+EAST_MEAN = (123.68, 116.78, 103.94)
+EAST_MODEL = 'frozen_east_text_detection.pb'
+
+
+def decode_predictions(scores, geometry, min_confidence: float = 0.8,
+                       rotated: bool = False):
+    """Decodes the raw EAST output volumes into candidate boxes in bulk.
+
+    Returns an (N, 4) int array of (startX, startY, endX, endY) rectangles
+    and an (N,) array of their scores, in row-major order of the score map.
+    If rotated is True, a list of (center, (w, h), angle) rotated rects in
+    cv2.boxPoints() format is returned as a third element.
+    """
+    # grab the (row, column) coordinates of every cell whose score passes
+    # the threshold, in the same order the old double loop visited them
+    (ys, xs) = np.nonzero(scores[0, 0] >= min_confidence)
+    confidences = scores[0, 0, ys, xs]
+    (d0, d1, d2, d3, angles) = geometry[0][:, ys, xs]
+
+    # feature maps are 4x smaller than the input image
+    offsetX = (xs * 4).astype(np.float32)
+    offsetY = (ys * 4).astype(np.float32)
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    h = d0 + d2
+    w = d1 + d3
+
+    # astype() truncates towards zero, exactly like int() did per element
+    endX = (offsetX + (cos * d1) + (sin * d2)).astype(np.int64)
+    endY = (offsetY - (sin * d1) + (cos * d2)).astype(np.int64)
+    startX = (endX.astype(np.float32) - w).astype(np.int64)
+    startY = (endY.astype(np.float32) - h).astype(np.int64)
+    rects = np.stack([startX, startY, endX, endY], axis=1)
+
+    if not rotated:
+        return (rects, confidences)
+
+    # https://github.com/opencv/opencv/blob/master/samples/dnn/text_detection.py
+    oX = offsetX + (cos * d1) + (sin * d2)
+    oY = offsetY - (sin * d1) + (cos * d2)
+    centerX = 0.5 * ((-sin * h + oX) + (-cos * w + oX))
+    centerY = 0.5 * ((-cos * h + oY) + (sin * w + oY))
+    degrees = -1 * np.degrees(angles)
+    rotated_rects = [((float(cx), float(cy)), (float(rw), float(rh)), float(a))
+                     for (cx, cy, rw, rh, a)
+                     in zip(centerX, centerY, w, h, degrees)]
+    return (rects, confidences, rotated_rects)
+
+
+def decode_predictions_loop(scores, geometry, min_confidence: float = 0.8):
+    """Reference per-cell decoder (the original find_text implementation).
+    Kept only so Frame.benchmark_decoding() can compare both paths.
+    """
+    (numRows, numCols) = scores.shape[2:4]
+    rects = []
+    confidences = []
+    for y in range(0, numRows):
+        scoresData = scores[0, 0, y]
+        xData0 = geometry[0, 0, y]
+        xData1 = geometry[0, 1, y]
+        xData2 = geometry[0, 2, y]
+        xData3 = geometry[0, 3, y]
+        anglesData = geometry[0, 4, y]
+        for x in range(0, numCols):
+            if scoresData[x] < min_confidence:
+                continue
+            (offsetX, offsetY) = (x * 4.0, y * 4.0)
+            angle = anglesData[x]
+            cos = np.cos(angle)
+            sin = np.sin(angle)
+            h = xData0[x] + xData2[x]
+            w = xData1[x] + xData3[x]
+            endX = int(offsetX + (cos * xData1[x]) + (sin * xData2[x]))
+            endY = int(offsetY - (sin * xData1[x]) + (cos * xData2[x]))
+            startX = int(endX - w)
+            startY = int(endY - h)
+            rects.append((startX, startY, endX, endY))
+            confidences.append(scoresData[x])
+    return (rects, confidences)
+
+
+def non_max_suppression(boxes, probs, overlap_thresh: float = 0.3):
+    """Greedy non-maxima suppression with the same semantics as
+    imutils.object_detection.non_max_suppression, operating on arrays only.
+    Each pick discards its overlaps from the remaining candidates with one
+    vectorized comparison, so the work shrinks as boxes are suppressed.
+
+    Returns the indices of the kept boxes, highest probability first.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    boxes = np.asarray(boxes, dtype=np.float64)
+    (x1, y1, x2, y2) = boxes.T
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    # imutils sorts ascending and pops from the end; walking the reversed
+    # argsort visits ties in exactly the same order
+    remaining = np.argsort(probs)[::-1]
+    pick = []
+    while len(remaining) > 0:
+        i = remaining[0]
+        pick.append(i)
+        rest = remaining[1:]
+
+        # the overlap ratio is taken relative to the area of the candidate
+        # box, not the union, as in imutils
+        w = np.maximum(0, np.minimum(x2[i], x2[rest]) -
+                          np.maximum(x1[i], x1[rest]) + 1)
+        h = np.maximum(0, np.minimum(y2[i], y2[rest]) -
+                          np.maximum(y1[i], y1[rest]) + 1)
+        overlap = (w * h) / area[rest]
+        remaining = rest[overlap <= overlap_thresh]
+    return np.array(pick, dtype=np.int64)
+
+
+def east_input_size(shape: tuple, input_size: tuple = None):
+    """Returns the (width, height) an image of the given shape is resized to
+    before going through EAST.  Both dimensions must be multiples of 32; by
+    default the image is cropped down to the nearest multiple.
+    """
+    if input_size is None:
+        (H, W) = shape[:2]
+        return (W - W % 32, H - H % 32)
+    (W, H) = input_size
+    if W % 32 or H % 32:
+        raise ValueError(f"EAST input size must be a multiple of 32: "
+                         f"{input_size}")
+    return (W, H)
+
+
+def detection_size(shape: tuple, width: int):
+    """Returns the EAST input (width, height) for detecting at roughly the
+    given width, keeping the aspect ratio of an image of the given shape.
+    """
+    (H, W) = shape[:2]
+    height = H * width / float(W)
+    return (max(32, width - width % 32),
+            max(32, int(height) - int(height) % 32))
+
+
+def boxes_from_predictions(scores, geometry, ratios: tuple,
+                           min_confidence: float = 0.8,
+                           rotated: bool = False):
+    """Decodes, suppresses and rescales one image's worth of EAST output.
+
+    ratios is the (rW, rH) scale from the network input back to the
+    original frame.  Returns (results, confidences), where confidences[i]
+    is the score of results[i].
+    """
+    (rW, rH) = ratios
+    decoded = decode_predictions(scores, geometry, min_confidence, rotated)
+    (rects, confidences) = decoded[:2]
+
+    # apply non-maxima suppression to suppress weak, overlapping bounding
+    # boxes
+    pick = non_max_suppression(rects, confidences)
+
+    # scale the bounding box coordinates based on the respective ratios
+    if rotated:
+        results = []
+        for i in pick:
+            ((cx, cy), (w, h), angle) = decoded[2][i]
+            results.append(RotatedBoundingBox((cx * rW, cy * rH),
+                                              (w * rW, h * rH),
+                                              angle))
+    else:
+        scaled = (rects[pick] * np.array([rW, rH, rW, rH])).astype(int)
+        results = [BoundingBox(*map(int, row)) for row in scaled]
+    return (results, confidences[pick].tolist())
+
+
+def detections_to_json(results, confidences):
+    boxes = []
+    for bb in results:
+        if isinstance(bb, RotatedBoundingBox):
+            boxes.append([*bb.rotated_center, *bb.dims, bb.angle])
+        else:
+            boxes.append([bb.startX, bb.startY, bb.endX, bb.endY])
+    return {'boxes': boxes, 'confidences': [float(c) for c in confidences]}
+
+
+def detections_from_json(record):
+    results = []
+    for box in record['boxes']:
+        if len(box) == 5:
+            (cx, cy, w, h, angle) = box
+            results.append(RotatedBoundingBox((cx, cy), (w, h), angle))
+        else:
+            results.append(BoundingBox(*box))
+    return (results, record['confidences'])
+
+
+def dhash(image, hash_size: int = 8):
+    """Difference hash: compares horizontally adjacent pixels of a
+    (hash_size + 1) x hash_size grayscale thumbnail.  Returns a
+    hash_size ** 2 bit integer.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(image, (hash_size + 1, hash_size),
+                         interpolation=cv2.INTER_AREA)
+    diff = resized[:, 1:] > resized[:, :-1]
+    return int.from_bytes(np.packbits(diff).tobytes(), 'big')
+
+
+def phash(image, hash_size: int = 8, highfreq_factor: int = 4):
+    """Perceptual hash: thresholds the lowest frequencies of the DCT of a
+    grayscale thumbnail against their median.  Returns a hash_size ** 2 bit
+    integer.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    size = hash_size * highfreq_factor
+    resized = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(np.float32(resized))
+    lowfreq = dct[:hash_size, :hash_size]
+    bits = lowfreq > np.median(lowfreq)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash1: int, hash2: int):
+    return bin(hash1 ^ hash2).count('1')
+
+
 class BoundingBox:
 
     def __init__(self, startX: int, startY: int, endX: int, endY: int):
@@ -37,150 +276,712 @@ class BoundingBox:
         width = self.endX - self.startX
         return height * width
 
+    def scaled(self, fx: float, fy: float):
+        return BoundingBox(int(self.startX * fx), int(self.startY * fy),
+                           int(self.endX * fx), int(self.endY * fy))
+
+    def iou(self, other):
+        width = min(self.endX, other.endX) - max(self.startX, other.startX)
+        height = min(self.endY, other.endY) - max(self.startY, other.startY)
+        if width <= 0 or height <= 0:
+            return 0.0
+        intersection = width * height
+        return intersection / float(self.size() + other.size() - intersection)
+
+
+class RotatedBoundingBox(BoundingBox):
+
+    def __init__(self, center: tuple, dims: tuple, angle: float):
+        self.rotated_center = center
+        self.dims = dims
+        self.angle = angle
+        points = self.points()
+        (startX, startY) = points.min(axis=0).astype(int)
+        (endX, endY) = points.max(axis=0).astype(int)
+        super().__init__(int(startX), int(startY), int(endX), int(endY))
+
+    def draw(self, image):
+        cv2.polylines(image,
+                      [self.points().astype(np.int32)],
+                      True,
+                      (0, 255, 0),
+                      2)
+
+    def points(self):
+        return cv2.boxPoints((self.rotated_center, self.dims, self.angle))
+
 
 class Frame:
 
     east_net = None
+    ocr_engine = None
+    result_cache = None     # set to a ResultCache to enable caching
+    writer = None           # set to a FrameWriter to save in the background
 
-    def __init__(self, image, video_name: str, timestamp: timedelta):
+    def __init__(self,
+                 image,
+                 video_name: str,
+                 timestamp: timedelta,
+                 full_size: tuple = None,
+                 full_image=None,
+                 source=None):
+        # A frame may carry a downscaled image for detection.  In that case
+        # full_size is the (width, height) of the original video, boxes are
+        # always reported in full resolution coordinates, and the original
+        # pixels come either from full_image or, on demand, from source (a
+        # FrameExtractor that can re-read this timestamp).
         self.image = image
         self.video_name = video_name
         self.timestamp = timestamp
+        self.full_size = full_size or (image.shape[1], image.shape[0])
+        self._full_image = full_image
+        self.source = source
 
-    def find_text(self, min_confidence: float = 0.8, save_boxes: bool = False):
-        # https://www.pyimagesearch.com/2018/08/20/opencv-text-detection-east-text-detector/
-        # load the input image and grab the image dimensions
-        image = self.image.copy()
-        (H, W) = image.shape[:2]
+    def is_downscaled(self):
+        return self.full_size != (self.image.shape[1], self.image.shape[0])
 
-        # set the new width and height and then determine the ratio in change
-        # for both the width and height
-        (newH, newW) = (H - H % 32, W - W % 32)
-        rW = W / float(newW)
-        rH = H / float(newH)
+    def full_image(self):
+        if not self.is_downscaled():
+            return self.image
+        if self._full_image is None and self.source is not None:
+            self._full_image = self.source.frame_at(self.timestamp).image
+        if self._full_image is None:
+            return self.image
+        return self._full_image
 
-        # resize the image and grab the new image dimensions
-        image = cv2.resize(image, (newW, newH))
-        (H, W) = image.shape[:2]
-
-        # define the two output layer names for the EAST detector model that
-        # we are interested -- the first is the output probabilities and the
-        # second can be used to derive the bounding box coordinates of text
-        layerNames = [
-    	   "feature_fusion/Conv_7/Sigmoid",
-	       "feature_fusion/concat_3"]
+    def downscaled(self, width: int):
+        (W, H) = self.full_size
+        height = int(round(H * width / float(W)))
+        image = cv2.resize(self.full_image(), (width, height),
+                           interpolation=cv2.INTER_AREA)
+        return Frame(image, self.video_name, self.timestamp,
+                     full_size=self.full_size,
+                     full_image=self.full_image(),
+                     source=self.source)
 
+    @classmethod
+    def load_east_net(cls):
         # load the pre-trained EAST text detector
-        if not Frame.east_net:
+        if not cls.east_net:
             print("[INFO] loading EAST text detector...", end='\r')
-            net_path = Path(SOURCE_DIR, 'frozen_east_text_detection.pb')
-            Frame.east_net = cv2.dnn.readNet(str(net_path))
+            net_path = Path(SOURCE_DIR, EAST_MODEL)
+            cls.east_net = cv2.dnn.readNet(str(net_path))
+        return cls.east_net
+
+    @classmethod
+    def load_ocr_engine(cls):
+        if not cls.ocr_engine:
+            cls.ocr_engine = get_engine()
+        return cls.ocr_engine
 
-        # construct a blob from the image and then perform a forward pass of
-        # the model to obtain the two output layer sets
-        blob = cv2.dnn.blobFromImage(image, 1.0, (W, H),
-        	(123.68, 116.78, 103.94), swapRB=True, crop=False)
+    def cache_key(self, kind: str, **params):
+        if Frame.result_cache is None:
+            return None
+        return ResultCache.key(self.image, kind, **params)
+
+    def detection_key(self, min_confidence: float, rotated: bool,
+                      input_size: tuple = None):
+        return self.cache_key('detection',
+                              model=EAST_MODEL,
+                              min_confidence=min_confidence,
+                              rotated=rotated,
+                              full_size=self.full_size,
+                              input_size=east_input_size(self.image.shape,
+                                                         input_size))
+
+    def east_forward(self, input_size: tuple = None):
+        # https://www.pyimagesearch.com/2018/08/20/opencv-text-detection-east-text-detector/
+        # grab the (full resolution) frame dimensions, then set the new width
+        # and height and determine the ratio in change for both the width and
+        # height
+        (W, H) = self.full_size
+        (newW, newH) = east_input_size(self.image.shape, input_size)
+        rW = W / float(newW)
+        rH = H / float(newH)
+
+        # construct a blob from the image (blobFromImage does the resizing)
+        # and then perform a forward pass of the model to obtain the two
+        # output layer sets
+        net = Frame.load_east_net()
+        blob = cv2.dnn.blobFromImage(self.image, 1.0, (newW, newH), EAST_MEAN,
+                                     swapRB=True, crop=False)
         start = time.time()
-        Frame.east_net.setInput(blob)
-        (scores, geometry) = Frame.east_net.forward(layerNames)
+        net.setInput(blob)
+        (scores, geometry) = net.forward(EAST_LAYER_NAMES)
         end = time.time()
 
         # show timing information on text prediction
         print("[INFO] text detection took {:.6f} seconds".format(end - start))
+        return (scores, geometry, (rW, rH))
 
-        # grab the number of rows and columns from the scores volume, then
-        # initialize our set of bounding box rectangles and corresponding
-        # confidence scores
-        (numRows, numCols) = scores.shape[2:4]
-        rects = []
-        confidences = []
-
-        # loop over the number of rows
-        for y in range(0, numRows):
-            # extract the scores (probabilities), followed by the geometrical
-            # data used to derive potential bounding box coordinates that
-            # surround text
-            scoresData = scores[0, 0, y]
-            xData0 = geometry[0, 0, y]
-            xData1 = geometry[0, 1, y]
-            xData2 = geometry[0, 2, y]
-            xData3 = geometry[0, 3, y]
-            anglesData = geometry[0, 4, y]
-
-            # loop over the number of columns
-            for x in range(0, numCols):
-                # if our score does not have sufficient probability, ignore it
-                if scoresData[x] < min_confidence:
-                    continue
-                # compute the offset factor as our resulting feature maps will
-                # be 4x smaller than the input image
-                (offsetX, offsetY) = (x * 4.0, y * 4.0)
-                # extract the rotation angle for the prediction and then
-                # compute the sin and cosine
-                angle = anglesData[x]
-                cos = np.cos(angle)
-                sin = np.sin(angle)
-                # use the geometry volume to derive the width and height of
-                # the bounding box
-                h = xData0[x] + xData2[x]
-                w = xData1[x] + xData3[x]
-                # compute both the starting and ending (x, y)-coordinates for
-                # the text prediction bounding box
-                endX = int(offsetX + (cos * xData1[x]) + (sin * xData2[x]))
-                endY = int(offsetY - (sin * xData1[x]) + (cos * xData2[x]))
-                startX = int(endX - w)
-                startY = int(endY - h)
-                # add the bounding box coordinates and probability score to
-                # our respective lists
-                rects.append((startX, startY, endX, endY))
-                confidences.append(scoresData[x])
-
-        # apply non-maxima suppression to suppress weak, overlapping bounding
-        # boxes
-        boxes = non_max_suppression(np.array(rects), probs=confidences)
-
-        # rescale bounding boxes and return
-        results = []
-        for (startX, startY, endX, endY) in boxes:
-            # scale the bounding box coordinates based on the respective
-            # ratios
-            startX = int(startX * rW)
-            startY = int(startY * rH)
-            endX = int(endX * rW)
-            endY = int(endY * rH)
-            bb = BoundingBox(startX, startY, endX, endY)
-            results.append(bb)
-
+    def find_text(self,
+                  min_confidence: float = 0.8,
+                  save_boxes: bool = False,
+                  rotated: bool = False,
+                  input_size: tuple = None):
+        key = self.detection_key(min_confidence, rotated, input_size)
+        cached = Frame.result_cache.get(key) if key else None
+        if cached is not None:
+            (results, confidences) = detections_from_json(cached)
+        else:
+            (scores, geometry, ratios) = self.east_forward(input_size)
+            (results, confidences) = boxes_from_predictions(scores, geometry,
+                                                            ratios,
+                                                            min_confidence,
+                                                            rotated)
+            if key:
+                Frame.result_cache.put(key, detections_to_json(results,
+                                                               confidences))
         if save_boxes:
+            (fx, fy) = (self.image.shape[1] / float(self.full_size[0]),
+                        self.image.shape[0] / float(self.full_size[1]))
             for bb in results:
-                bb.draw(self.image)
+                bb.scaled(fx, fy).draw(self.image)
             self.save(replace=True)
 
         return (results, confidences)
 
-    def text(self):
+    def benchmark_decoding(self,
+                           min_confidence: float = 0.8,
+                           iterations: int = 10):
+        (scores, geometry, ratios) = self.east_forward()
+        (rW, rH) = ratios
+
+        def by_loop():
+            (rects, confidences) = decode_predictions_loop(scores, geometry,
+                                                           min_confidence)
+            boxes = object_detection.non_max_suppression(np.array(rects),
+                                                         probs=confidences)
+            return [(int(startX * rW), int(startY * rH),
+                     int(endX * rW), int(endY * rH))
+                    for (startX, startY, endX, endY) in boxes]
+
+        def by_vector():
+            (results, _) = boxes_from_predictions(scores, geometry, ratios,
+                                                  min_confidence)
+            return [(bb.startX, bb.startY, bb.endX, bb.endY)
+                    for bb in results]
+
+        def timed(func):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                output = func()
+            end = time.perf_counter()
+            return ((end - start) / iterations, output)
+
+        (loop_runtime, loop_boxes) = timed(by_loop)
+        (vector_runtime, vector_boxes) = timed(by_vector)
+        fieldnames = ['resolution', 'candidates', 'loop_runtime',
+                      'vectorized_runtime', 'identical']
+        result = {
+            fieldnames[0] : '%dx%d' % self.image.shape[1::-1],
+            fieldnames[1] : int((scores[0, 0] >= min_confidence).sum()),
+            fieldnames[2] : loop_runtime,
+            fieldnames[3] : vector_runtime,
+            fieldnames[4] : sorted(loop_boxes) == sorted(vector_boxes)
+        }
+
+        test_path = Path(SOURCE_DIR, 'Tests', 'Frame',
+                         'decoding_loop_vs_vectorized.csv')
+        test_path.parents[0].mkdir(parents=True, exist_ok=True)
+        write_header = not test_path.exists()
+        with test_path.open('a') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(result)
+        return result
+
+    def crop(self, box: BoundingBox, padding: float = 0.1):
+        # pad by a fraction of the box dimensions, since EAST boxes tend to
+        # clip ascenders and descenders, then clamp to the frame.  Crops are
+        # always taken from full resolution pixels
+        image = self.full_image()
+        (H, W) = image.shape[:2]
+        dX = int((box.endX - box.startX) * padding)
+        dY = int((box.endY - box.startY) * padding)
+        startX = max(0, box.startX - dX)
+        startY = max(0, box.startY - dY)
+        endX = min(W, box.endX + dX)
+        endY = min(H, box.endY + dY)
+        return image[startY:endY, startX:endX]
+
+    def read_text(self,
+                  min_confidence: float = 0.8,
+                  padding: float = 0.1,
+                  engine=None):
+        (results, confidences) = self.find_text(min_confidence)
+        detections = [(self, results, confidences)]
+        for (_, _, _, texts) in read_text(detections, engine, padding):
+            return (results, confidences, texts)
+
+    def preprocessed(self):
         # preprocess to enhance accuracy
         # convert to grayscale:
         i = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
         # dilate
-        i = cv2.dilate(self.image, np.ones((5, 5)), iterations=1)
+        i = cv2.dilate(i, np.ones((5, 5)), iterations=1)
         # denoise
-        i = cv2.GaussianBlur(self.image, )
+        i = cv2.GaussianBlur(i, (5, 5), 0)
         # threshold
-        i = cv2.threshold(self.image, 0, 255,
-                              cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-        return pytesseract.image_to_string(i, lang='eng')
+        i = cv2.threshold(i, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        return i
 
-    def save(self, replace: bool = False):
+    def text(self, engine=None):
+        # for more than one frame, frames_text() batches the OCR calls
+        for (_, text) in frames_text([self], engine):
+            return text
+
+    def save(self, replace: bool = False, archive=None):
+        # with a FrameArchive, the frame is appended to the video's archive
+        # instead of being written out as its own PNG
+        if archive is not None:
+            archive.append(self)
+            return True
+        extension = Frame.writer.extension if Frame.writer else 'png'
         dest_path = Path(ROOT_DIR, 'Frames', self.video_name,
-                         '%s.png' % str(self.timestamp))
+                         '%s.%s' % (str(self.timestamp), extension))
         if replace or not dest_path.exists():
+            if Frame.writer is not None:
+                Frame.writer.write(dest_path, self.image)
+                return True
             dest_path.parents[0].mkdir(parents=True, exist_ok=True)
             cv2.imwrite(str(dest_path), self.image)
             return True
         return False
 
 
+def find_text_batched(frames,
+                      batch_size: int = 16,
+                      input_size: tuple = None,
+                      min_confidence: float = 0.8,
+                      rotated: bool = False,
+                      detection_width: int = None):
+    """Runs EAST over a stream of Frames, batch_size frames per forward pass.
+
+    Every frame in a batch is resized to the same input_size (width, height),
+    which defaults to the first frame's dimensions rounded down to a multiple
+    of 32, or to detection_width and the matching height if that is given.
+    Boxes are always in full resolution frame coordinates.  Yields (frame,
+    results, confidences) in input order, with the same per-frame output as
+    Frame.find_text().
+    """
+    net = Frame.load_east_net()
+
+    def detect(batch):
+        (W, H) = size
+        keys = [f.detection_key(min_confidence, rotated, size) for f in batch]
+        output = [Frame.result_cache.get(k) if k else None for k in keys]
+        misses = [i for (i, cached) in enumerate(output) if cached is None]
+
+        # only frames that weren't in the cache go through the network
+        if misses:
+            images = [batch[i].image for i in misses]
+            blob = cv2.dnn.blobFromImages(images, 1.0, (W, H), EAST_MEAN,
+                                          swapRB=True, crop=False)
+            start = time.time()
+            net.setInput(blob)
+            (scores, geometry) = net.forward(EAST_LAYER_NAMES)
+            end = time.time()
+            print("[INFO] text detection took {:.6f} seconds ({} frames)"
+                  .format(end - start, len(misses)))
+
+        for (j, i) in enumerate(misses):
+            (frameW, frameH) = batch[i].full_size
+            ratios = (frameW / float(W), frameH / float(H))
+            detections = boxes_from_predictions(
+                scores[j:j + 1], geometry[j:j + 1], ratios, min_confidence,
+                rotated)
+            output[i] = detections_to_json(*detections)
+            if keys[i]:
+                Frame.result_cache.put(keys[i], output[i])
+
+        for (frame, record) in zip(batch, output):
+            (results, confidences) = detections_from_json(record)
+            yield (frame, results, confidences)
+
+    size = None
+    batch = []
+    for frame in frames:
+        if size is None and detection_width:
+            size = detection_size(frame.image.shape, detection_width)
+        elif size is None:
+            size = east_input_size(frame.image.shape, input_size)
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield from detect(batch)
+            batch = []
+    if batch:
+        yield from detect(batch)
+
+
+def frames_text(frames, engine=None, batch_size: int = 16):
+    """OCRs whole frames, like Frame.text(), but sends the ones that aren't
+    cached to the engine batch_size at a time through its map(), so the
+    command line backend starts one tesseract process per batch rather
+    than per frame.  Yields (frame, text) in input order.
+    """
+    if engine is None:
+        engine = Frame.load_ocr_engine()
+    pending = deque()   # [frame, text, cache key], text None until read
+
+    def misses():
+        for frame in frames:
+            key = frame.cache_key('text', engine=engine.signature())
+            cached = Frame.result_cache.get(key) if key else None
+            pending.append([frame, cached, key])
+            if cached is None:
+                yield frame.preprocessed()
+
+    def completed():
+        while pending and pending[0][1] is not None:
+            (frame, text, _) = pending.popleft()
+            yield (frame, text)
+
+    # misses() records every frame before handing over the ones to read,
+    # and map() returns texts in order, so each text belongs to the oldest
+    # frame still waiting for one
+    for text in engine.map(misses(), batch_size):
+        entry = next(e for e in pending if e[1] is None)
+        entry[1] = text
+        if entry[2]:
+            Frame.result_cache.put(entry[2], text)
+        yield from completed()
+    yield from completed()
+
+
+def read_text(detections,
+              engine=None,
+              padding: float = 0.1,
+              line_height: int = 48,
+              lines_per_montage: int = 32):
+    """OCRs only the detected text regions of a detection stream, such as
+    the output of find_text_batched().  Box crops from consecutive frames
+    are packed lines_per_montage at a time into a single montage image per
+    tesseract call, and the recognized words are mapped back to their boxes.
+
+    Yields (frame, results, confidences, texts) in input order, where
+    texts[i] is the text read from results[i].
+    """
+    if engine is None:
+        engine = Frame.load_ocr_engine()
+    pending = deque()   # [frame, results, confidences, texts, outstanding]
+    crops = []          # (pending entry, box index, crop)
+
+    def crop_key(crop):
+        if Frame.result_cache is None:
+            return None
+        return ResultCache.key(crop, 'montage_text',
+                               engine=engine.signature(),
+                               line_height=line_height)
+
+    def flush():
+        (page, slots) = build_montage([c for (_, _, c) in crops], line_height)
+        words = engine.recognize_words(page)
+        for ((entry, i, crop), text) in zip(crops, assign_words(words, slots)):
+            entry[3][i] = text
+            entry[4] -= 1
+            key = crop_key(crop)
+            if key:
+                Frame.result_cache.put(key, text)
+        crops.clear()
+
+    def completed():
+        while pending and pending[0][4] == 0:
+            (frame, results, confidences, texts, _) = pending.popleft()
+            yield (frame, results, confidences, texts)
+
+    for (frame, results, confidences) in detections:
+        entry = [frame, results, confidences, [''] * len(results),
+                 len(results)]
+        pending.append(entry)
+        for (i, box) in enumerate(results):
+            crop = frame.crop(box, padding)
+            if crop.size == 0:
+                entry[4] -= 1
+                continue
+            key = crop_key(crop)
+            cached = Frame.result_cache.get(key) if key else None
+            if cached is not None:
+                entry[3][i] = cached
+                entry[4] -= 1
+                continue
+            crops.append((entry, i, crop))
+            if len(crops) >= lines_per_montage:
+                flush()
+        yield from completed()
+    if crops:
+        flush()
+    yield from completed()
+
+
+class FrameDeduplicator:
+
+    def __init__(self, threshold: int = 4, hash_func=dhash):
+        self.threshold = threshold
+        self.hash_func = hash_func
+        self.last_hash = None
+        self.kept = 0
+        self.skipped = 0
+
+    def is_duplicate(self, frame: Frame):
+        # frames are compared against the last frame that was kept, not the
+        # one immediately before, so slow fades can't creep past the filter
+        frame_hash = self.hash_func(frame.image)
+        if (self.last_hash is not None and
+            hamming_distance(frame_hash, self.last_hash) <= self.threshold):
+            self.skipped += 1
+            return True
+        self.last_hash = frame_hash
+        self.kept += 1
+        return False
+
+    def filter(self, frames):
+        """Yields only frames that differ from the previously kept one"""
+        for frame in frames:
+            if not self.is_duplicate(frame):
+                yield frame
+
+    def find_text(self, frames, min_confidence: float = 0.8):
+        """Yields (frame, results, confidences) for every frame, running
+        EAST only on frames that aren't duplicates and reusing the last
+        detection for the ones that are.
+        """
+        for frame in frames:
+            if not self.is_duplicate(frame):
+                (results, confidences) = frame.find_text(min_confidence)
+            yield (frame, results, confidences)
+
+    def __str__(self):
+        total = self.kept + self.skipped
+        percent = self.skipped / total * 100 if total else 0
+        return (f"[INFO] dedup kept {self.kept} frames, skipped "
+                f"{self.skipped} ({percent:.1f}%)")
+
+
+class KeyframeIndex:
+
+    def __init__(self, keyframes: list, fps: float):
+        self.keyframes = sorted(keyframes)   # presentation times, in seconds
+        self.fps = fps
+
+    @staticmethod
+    def cache_path(video_path: Path):
+        return video_path.with_name(video_path.name + '.keyframes.json')
+
+    @classmethod
+    def load(cls, video_path: Path):
+        """Returns the keyframe index for a video, reading it from the json
+        file next to the video if that is still current, or probing the
+        video (and saving the result) if not.
+        """
+        video_path = Path(video_path)
+        stat = video_path.stat()
+        cache_path = cls.cache_path(video_path)
+        try:
+            with cache_path.open('r') as infile:
+                saved = json.load(infile)
+            if (saved['size'] == stat.st_size and
+                saved['mtime'] == stat.st_mtime):
+                return cls(saved['keyframes'], saved['fps'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass    # missing or unreadable, so probe again
+
+        index = cls.probe(video_path)
+        # several processes may probe the same video at once
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+        with tmp_path.open('w') as outfile:
+            json.dump({
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'fps': index.fps,
+                'keyframes': index.keyframes
+            }, outfile)
+        os.replace(tmp_path, cache_path)
+        return index
+
+    @classmethod
+    def probe(cls, video_path: Path):
+        # reading packet flags only demuxes the file, it never decodes
+        if shutil.which('ffprobe') is None:
+            raise RuntimeError("ffprobe executable not found on PATH")
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=avg_frame_rate',
+               '-of', 'csv=p=0', str(video_path)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        fps = float(Fraction(result.stdout.decode().strip().split(',')[0]))
+
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags',
+               '-of', 'csv=p=0', str(video_path)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        keyframes = []
+        for line in result.stdout.decode().splitlines():
+            (pts_time, flags) = line.split(',')[:2]
+            if 'K' in flags and pts_time != 'N/A':
+                keyframes.append(float(pts_time))
+        return cls(keyframes, fps)
+
+    def keyframe_before(self, seconds: float):
+        i = bisect_right(self.keyframes, seconds) - 1
+        return self.keyframes[i] if i >= 0 else 0.0
+
+    def plan(self, timestamps, seek_overhead: int = 15):
+        """Decides how to reach each requested timestamp with the fewest
+        decoded frames.  Grabbing from the current position decodes every
+        frame in between; seeking decodes from the nearest keyframe at or
+        before the target, plus a fixed seek_overhead (in frames) for
+        flushing the decoder and repositioning the demuxer.
+
+        Returns a list of (timestamp, seek) pairs and the estimated number
+        of frames decoded.
+        """
+        plan = []
+        decoded = 0
+        position = None     # index of the last decoded frame
+        for timestamp in timestamps:
+            seconds = timestamp.total_seconds()
+            target = round(seconds * self.fps)
+            keyframe = round(self.keyframe_before(seconds) * self.fps)
+            seek_cost = target - keyframe + 1 + seek_overhead
+            if position is None or target <= position:
+                seek = True
+            else:
+                seek = seek_cost < target - position
+            decoded += seek_cost if seek else target - position
+            plan.append((timestamp, seek))
+            position = target
+        return (plan, decoded)
+
+
+class DecodeProfile:
+    """Measured decoding costs for one kind of video.
+
+    Seek and grab costs depend mostly on the codec, resolution and
+    container, so a profile is measured on a few short random windows of
+    the first video of each kind and reused (from
+    Tests/FrameExtractor/decode_profiles.json) for every other video with
+    the same signature.
+    """
+
+    def __init__(self, signature: str, grab_cost: float, seek_cost: float,
+                 seek_fixed: float, fps: float):
+        self.signature = signature
+        self.grab_cost = grab_cost      # seconds per grabbed frame
+        self.seek_cost = seek_cost      # seconds per seek + read, on average
+        self.seek_fixed = seek_fixed    # part of seek_cost not spent decoding
+        self.fps = fps
+
+    @staticmethod
+    def signature_of(video_path: Path, capture):
+        fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+        codec = ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))
+        W = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        H = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        container = Path(video_path).suffix.lstrip('.').lower()
+        return f"{codec.strip() or 'unknown'}-{W}x{H}-{container}"
+
+    @staticmethod
+    def cache_path():
+        return Path(SOURCE_DIR, 'Tests', 'FrameExtractor',
+                    'decode_profiles.json')
+
+    @classmethod
+    def cached(cls, signature: str):
+        cache_path = cls.cache_path()
+        if not cache_path.exists():
+            return None
+        with cache_path.open('r') as infile:
+            profiles = json.load(infile)
+        if signature not in profiles:
+            return None
+        return cls(signature, **profiles[signature])
+
+    def save(self):
+        cache_path = self.cache_path()
+        cache_path.parents[0].mkdir(parents=True, exist_ok=True)
+        profiles = {}
+        if cache_path.exists():
+            with cache_path.open('r') as infile:
+                profiles = json.load(infile)
+        profiles[self.signature] = {
+            'grab_cost': self.grab_cost,
+            'seek_cost': self.seek_cost,
+            'seek_fixed': self.seek_fixed,
+            'fps': self.fps
+        }
+        # several extractors may be tuning at once
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+        with tmp_path.open('w') as outfile:
+            json.dump(profiles, outfile, indent=2)
+        os.replace(tmp_path, cache_path)
+
+    @classmethod
+    def measure(cls, extractor, windows: int = 5, grabs: int = 30,
+                seed: int = None):
+        """Times a seek followed by a run of grabs at a few random points in
+        the video.  Returns None if the video can't be read.
+        """
+        video = extractor.video
+        fps = video.get(cv2.CAP_PROP_FPS)
+        duration = extractor.duration()
+        if not fps or duration is None:
+            return None
+        index = extractor.keyframe_index()
+        rng = np.random.default_rng(seed)
+        latest = max(0, duration.total_seconds() - 2 * grabs / fps)
+
+        seek_times = []
+        seek_distances = []     # frames decoded between keyframe and target
+        grab_times = []
+        for seconds in sorted(rng.uniform(0, latest, windows)):
+            start = time.time()
+            video.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+            (capture_success, _) = video.read()
+            if not capture_success:
+                continue
+            seek_times.append(time.time() - start)
+            if index is not None:
+                keyframe = index.keyframe_before(seconds)
+                seek_distances.append(round((seconds - keyframe) * fps) + 1)
+
+            start = time.time()
+            grabbed = 0
+            while grabbed < grabs and video.grab():
+                grabbed += 1
+            if grabbed:
+                grab_times.append((time.time() - start) / grabbed)
+        if not seek_times or not grab_times:
+            return None
+
+        grab_cost = float(np.median(grab_times))
+        seek_cost = float(np.mean(seek_times))
+        if seek_distances:
+            seek_fixed = float(np.mean([t - d * grab_cost for (t, d) in
+                                        zip(seek_times, seek_distances)]))
+        else:
+            seek_fixed = seek_cost
+        signature = cls.signature_of(extractor.path, video)
+        return cls(signature, grab_cost, seek_cost, max(seek_fixed, 0), fps)
+
+    def seek_overhead(self):
+        """Fixed cost of a seek, in frames, for KeyframeIndex.plan()"""
+        return int(round(self.seek_fixed / self.grab_cost))
+
+    def tuning_threshold(self):
+        """Smallest step at which seeking to every frame beats grabbing
+        through the whole video, for when no keyframe index is available.
+        """
+        return timedelta(seconds=self.seek_cost / (self.grab_cost * self.fps))
+
+    def __str__(self):
+        return (f"[INFO] decode profile {self.signature}: "
+                f"{self.grab_cost * 1000:.2f} ms/grab, "
+                f"{self.seek_cost * 1000:.2f} ms/seek "
+                f"({self.seek_overhead()} frames fixed overhead), "
+                f"threshold {self.tuning_threshold()}")
+
+
 class FrameExtractor:
 
     tuning_threshold_default = timedelta(seconds=4) # for personal machine
@@ -189,6 +990,7 @@ class FrameExtractor:
         self.path = video_path
         self.video_name = video_path.parts[-2]
         self.video = cv2.VideoCapture(str(video_path))
+        self.keyframes = None
 
         self.tuning_threshold = FrameExtractor.tuning_threshold_default
         bench_test = Path(SOURCE_DIR, 'Tests', 'FrameExtractor',
@@ -205,25 +1007,374 @@ class FrameExtractor:
                     self.tuning_threshold = timedelta(seconds=tune_step)
                     break
 
+        # a measured profile for this kind of video overrides the global
+        # benchmark; if there isn't one yet, it is measured the first time
+        # frames are requested (see decode_profile)
+        self.profile = None
+        if self.video.isOpened():
+            signature = DecodeProfile.signature_of(self.path, self.video)
+            self.profile = DecodeProfile.cached(signature)
+        if self.profile is not None:
+            self.tuning_threshold = self.profile.tuning_threshold()
+
+    def duration(self):
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        frame_count = self.video.get(cv2.CAP_PROP_FRAME_COUNT)
+        if not fps:
+            return None
+        return timedelta(seconds=frame_count / fps)
+
+    def keyframe_index(self):
+        # None if the video can't be probed, in which case frames() falls
+        # back on the benchmarked tuning threshold
+        if self.keyframes is None:
+            try:
+                self.keyframes = KeyframeIndex.load(self.path)
+            except (OSError, RuntimeError, ValueError,
+                    subprocess.CalledProcessError):
+                return None
+        return self.keyframes
+
+    def decode_profile(self):
+        if self.profile is None:
+            self.profile = DecodeProfile.measure(self)
+            if self.profile is None:
+                return None
+            self.profile.save()
+            self.tuning_threshold = self.profile.tuning_threshold()
+            print(self.profile)
+        return self.profile
+
     def frames(self,
                start: timedelta = timedelta(),
                stop: timedelta = None,
-               step: timedelta = timedelta(seconds=10)):
-        # Scrubbing by timestamp outperforms grabbing and discarding frames at
-        # some critical value.  On my personal computer, this threshold comes
-        # at a step size of 4 seconds between frames (the default).
-        # Running FrameExtractor.benchmark() on your machine can determine
-        # this value for your test environment.  When you do so, the result is
-        # stored in Source/Tests in csv form, and once a test has been run,
-        # FrameExtractor will intelligently load the derived threshold value
-        # during initialization.
-        if step < self.tuning_threshold:
+               step: timedelta = timedelta(seconds=10),
+               backend: str = None,
+               **kwargs):
+        # backend can force a specific decoding strategy: 'scene',
+        # 'parallel', 'plan', 'time', 'grab' or 'ffmpeg' (extra keyword
+        # arguments are passed through to it).  By default, frames are read
+        # according to a seek plan built from the video's keyframe index (see
+        # frames_by_plan), with the seek overhead taken from the video's
+        # DecodeProfile.
+        #
+        # If the video can't be indexed, we fall back on a threshold:
+        # scrubbing by timestamp outperforms grabbing and discarding frames at
+        # some critical value.  The DecodeProfile derives it from seek and
+        # grab costs sampled on a few short windows of the first video of
+        # each codec, resolution and container.  Without a profile, the value
+        # comes from a full FrameExtractor.benchmark() run stored in
+        # Source/Tests in csv form, or defaults to a step size of 4 seconds
+        # (measured on my personal computer).
+        backends = {
+            'scene': self.frames_by_scene,
+            'parallel': self.frames_in_parallel,
+            'plan': self.frames_by_plan,
+            'time': self.frames_by_time,
+            'grab': self.frames_by_grab,
+            'ffmpeg': self.frames_by_ffmpeg
+        }
+        profile = self.decode_profile() if backend is None else None
+        if backend is not None:
+            generator = backends[backend](start, stop, step, **kwargs)
+        elif self.keyframe_index() is not None:
+            seek_overhead = profile.seek_overhead() if profile else 15
+            generator = self.frames_by_plan(start, stop, step, seek_overhead)
+        elif step < self.tuning_threshold:
             generator = self.frames_by_grab(start, stop, step)
         else:
             generator = self.frames_by_time(start, stop, step)
         for frame in generator:
             yield frame
 
+    def find_text(self,
+                  start: timedelta = timedelta(),
+                  stop: timedelta = None,
+                  step: timedelta = timedelta(seconds=10),
+                  batch_size: int = 16,
+                  input_size: tuple = None,
+                  min_confidence: float = 0.8,
+                  dedup_threshold: int = None,
+                  detection_width: int = None,
+                  store=None):
+        # With a detection_width, frames are decoded (by ffmpeg, if it is
+        # available) or downscaled to that width before EAST, and full
+        # resolution pixels are only read back for frames whose boxes get
+        # cropped for OCR.
+        #
+        # With a ResultStore, every frame's boxes are recorded as they're
+        # found, and a rerun resumes after the last recorded timestamp.
+        if store is not None:
+            start = store.resume_from(self.video_name, start, step, 'detect')
+        if detection_width and shutil.which('ffmpeg'):
+            frames = self.frames(start, stop, step, backend='ffmpeg',
+                                 width=detection_width)
+        elif detection_width:
+            frames = (frame.downscaled(detection_width)
+                      for frame in self.frames(start, stop, step))
+        else:
+            frames = self.frames(start, stop, step)
+        dedup = None
+        if dedup_threshold is not None:
+            dedup = FrameDeduplicator(dedup_threshold)
+            frames = dedup.filter(frames)
+        for (frame, results, confidences) in find_text_batched(
+                frames, batch_size, input_size, min_confidence,
+                detection_width=detection_width):
+            if store is not None:
+                store.add(frame.video_name, frame.timestamp, results,
+                          confidences, kind='detect')
+            yield (frame, results, confidences)
+        if dedup:
+            print(dedup)
+
+    def read_text(self,
+                  start: timedelta = timedelta(),
+                  stop: timedelta = None,
+                  step: timedelta = timedelta(seconds=10),
+                  min_confidence: float = 0.8,
+                  dedup_threshold: int = None,
+                  detection_width: int = None,
+                  engine=None,
+                  store=None):
+        if store is not None:
+            start = store.resume_from(self.video_name, start, step, 'text')
+        detections = self.find_text(start, stop, step,
+                                    min_confidence=min_confidence,
+                                    dedup_threshold=dedup_threshold,
+                                    detection_width=detection_width)
+        for (frame, results, confidences, texts) in read_text(detections,
+                                                              engine):
+            if store is not None:
+                store.add(frame.video_name, frame.timestamp, results,
+                          confidences, texts, kind='text')
+            yield (frame, results, confidences, texts)
+
+    def frame_at(self, timestamp: timedelta):
+        self.video.set(cv2.CAP_PROP_POS_MSEC, timestamp.total_seconds() * 1000)
+        (capture_success, frame) = self.video.read()
+        if not capture_success:
+            raise RuntimeError(f"Could not read {timestamp} from {self.path}")
+        return Frame(frame, self.video_name, timestamp)
+
+    def timestamps(self,
+                   start: timedelta = timedelta(),
+                   stop: timedelta = None,
+                   step: timedelta = timedelta(seconds=10)):
+        # an unreadable video (cv2 reports no fps) has no known end, and
+        # yields no frames, as when reading it directly
+        if stop is None:
+            stop = self.duration()
+            if stop is None:
+                return []
+        timestamps = []
+        timestamp = start
+        while timestamp <= stop:
+            timestamps.append(timestamp)
+            timestamp += step
+        return timestamps
+
+    def frames_by_plan(self,
+                       start: timedelta = timedelta(),
+                       stop: timedelta = None,
+                       step: timedelta = timedelta(seconds=10),
+                       seek_overhead: int = 15):
+        print(self.video_name)
+        timestamps = self.timestamps(start, stop, step)
+        yield from self.frames_at(timestamps, seek_overhead)
+
+    def frames_at(self, timestamps: list, seek_overhead: int = 15):
+        # For each requested timestamp, either seek (which decodes forward
+        # from the preceding keyframe) or keep grabbing from the current
+        # position, whichever decodes fewer frames for this file's GOP
+        # structure.
+        index = self.keyframe_index()
+        if index is None:
+            raise RuntimeError(f"Could not index keyframes: {self.path}")
+        (plan, decoded) = index.plan(timestamps, seek_overhead)
+        seeks = sum(seek for (_, seek) in plan)
+        print("[INFO] seek plan: {} seeks, {} grabs, ~{} frames decoded"
+              .format(seeks, len(plan) - seeks, decoded))
+
+        # a timestamp counts as reached once we're within half a frame of it
+        half_frame = 500 / index.fps
+        for (timestamp, seek) in plan:
+            target = timestamp.total_seconds() * 1000
+            if seek:
+                self.video.set(cv2.CAP_PROP_POS_MSEC, target)
+                (capture_success, frame) = self.video.read()
+            else:
+                capture_success = self.video.grab()
+                while (capture_success and
+                       self.video.get(cv2.CAP_PROP_POS_MSEC) <
+                       target - half_frame):
+                    capture_success = self.video.grab()
+                if capture_success:
+                    (capture_success, frame) = self.video.retrieve()
+            if not capture_success:
+                break
+            print(timestamp, end='\r')
+            yield Frame(frame, self.video_name, timestamp)
+
+    def segments(self, timestamps: list, segment_length: int = 32):
+        """Splits timestamps into consecutive runs of at least
+        segment_length, cutting only where two neighbouring timestamps fall
+        in different GOPs.  Every timestamp lands in exactly one segment, and
+        no two segments need to decode the same keyframe interval.
+        """
+        index = self.keyframe_index()
+        segments = []
+        current = []
+        previous_keyframe = None
+        for timestamp in timestamps:
+            keyframe = index.keyframe_before(timestamp.total_seconds())
+            if (len(current) >= segment_length and
+                keyframe != previous_keyframe):
+                segments.append(current)
+                current = []
+            current.append(timestamp)
+            previous_keyframe = keyframe
+        if current:
+            segments.append(current)
+        return segments
+
+    def frames_in_parallel(self,
+                           start: timedelta = timedelta(),
+                           stop: timedelta = None,
+                           step: timedelta = timedelta(seconds=10),
+                           workers: int = None,
+                           segment_length: int = 32,
+                           max_bytes: int = 512 * 1024 ** 2):
+        # Each worker opens its own capture and decodes one keyframe-aligned
+        # segment at a time.  Segments are yielded back in order.
+        #
+        # Memory is bounded in frames rather than segments: the segments
+        # being decoded, waiting in order, and being yielded hold about
+        # max_bytes of pixels at most (segments only end on a GOP boundary,
+        # so they can run a little over segment_length).  For large frames
+        # the segments get shorter and fewer are queued.
+        if self.keyframe_index() is None:
+            raise RuntimeError(f"Could not index keyframes: {self.path}")
+        print(self.video_name)
+        workers = workers or os.cpu_count()
+        W = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        H = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        budget = max(1, max_bytes // max(1, W * H * 3))
+        segment_length = max(1, min(segment_length, budget // (workers + 2)))
+        max_pending = max(1, min(workers * 2, budget // segment_length - 1))
+        timestamps = self.timestamps(start, stop, step)
+        segments = self.segments(timestamps, segment_length)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            submissions = ((segment[0], extract_segment, (self.path, segment))
+                           for segment in segments)
+            for (_, frames) in ordered_results(executor, submissions,
+                                               max_pending):
+                for (timestamp, image) in frames:
+                    print(timestamp, end='\r')
+                    yield Frame(image, self.video_name, timestamp)
+
+    def frames_by_scene(self,
+                        start: timedelta = timedelta(),
+                        stop: timedelta = None,
+                        max_interval: timedelta = timedelta(seconds=10),
+                        min_interval: timedelta = timedelta(seconds=1),
+                        analysis_step: timedelta = timedelta(seconds=0.5),
+                        threshold: float = 0.03,
+                        analysis_width: int = 64,
+                        log_path: Path = None):
+        # Adaptive sampling.  Every analysis_step we look at a tiny grayscale
+        # thumbnail of the current frame and score it by its mean absolute
+        # difference (0 to 1) from the thumbnail of the last emitted frame.
+        # A frame is emitted when that score passes threshold (a cut, or an
+        # overlay like a lower third appearing), but never more often than
+        # min_interval, and at least once every max_interval regardless.
+        #
+        # Every decision is kept in self.sampling_log and, if log_path is
+        # given, written there as csv as soon as it is made (so the log
+        # survives a consumer that stops early); replay_sampling() reads the
+        # same timestamps back from such a log.
+        print(self.video_name)
+        self.sampling_log = []
+        fieldnames = ['timestamp', 'score', 'reason']
+
+        def thumbnail(image):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            (H, W) = gray.shape
+            size = (analysis_width, max(1, int(H * analysis_width / W)))
+            return cv2.resize(gray, size,
+                              interpolation=cv2.INTER_AREA).astype(np.int16)
+
+        outfile = None
+        writer = None
+        if log_path is not None:
+            log_path = Path(log_path)
+            log_path.parents[0].mkdir(parents=True, exist_ok=True)
+            outfile = log_path.open('w')
+            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+            writer.writeheader()
+
+        self.video.set(cv2.CAP_PROP_POS_MSEC, start.total_seconds() * 1000)
+        last_thumb = None
+        last_emit = None
+        next_analysis = start
+        try:
+            while self.video.grab():
+                curr_time = timedelta(
+                    milliseconds=self.video.get(cv2.CAP_PROP_POS_MSEC))
+                if stop and curr_time > stop:
+                    break
+                if curr_time < next_analysis:
+                    continue
+                next_analysis = curr_time + analysis_step
+                (capture_success, frame) = self.video.retrieve()
+                if not capture_success:
+                    break
+
+                thumb = thumbnail(frame)
+                if last_thumb is None:
+                    (score, reason) = (1.0, 'first')
+                else:
+                    score = float(np.abs(thumb - last_thumb).mean()) / 255
+                    elapsed = curr_time - last_emit
+                    if elapsed >= max_interval:
+                        reason = 'interval'
+                    elif score >= threshold and elapsed >= min_interval:
+                        reason = 'scene'
+                    else:
+                        continue
+                item = {
+                    fieldnames[0] : curr_time.total_seconds(),
+                    fieldnames[1] : score,
+                    fieldnames[2] : reason
+                }
+                self.sampling_log.append(item)
+                if writer is not None:
+                    writer.writerow(item)
+                    outfile.flush()
+                last_thumb = thumb
+                last_emit = curr_time
+                print(curr_time, end='\r')
+                yield Frame(frame, self.video_name, curr_time)
+        finally:
+            if outfile is not None:
+                outfile.close()
+            scenes = sum(item['reason'] == 'scene'
+                         for item in self.sampling_log)
+            print("[INFO] adaptive sampling emitted {} frames ({} scene "
+                  "changes)".format(len(self.sampling_log), scenes))
+
+    def replay_sampling(self, log_path: Path):
+        # re-extract exactly the frames chosen by an earlier frames_by_scene
+        with Path(log_path).open('r') as infile:
+            reader = csv.DictReader(infile)
+            timestamps = [timedelta(seconds=float(row['timestamp']))
+                          for row in reader]
+        if self.keyframe_index() is not None:
+            yield from self.frames_at(timestamps)
+        else:
+            for timestamp in timestamps:
+                yield self.frame_at(timestamp)
+
     def frames_by_time(self,
                        start: timedelta = timedelta(),
                        stop: timedelta = None,
@@ -246,7 +1397,7 @@ class FrameExtractor:
                        stop: timedelta = None,
                        step: timedelta = timedelta(seconds=1)):
         print(self.video_name)
-        self.video.set(cv2.CAP_PROP_POS_MSEC, start.microseconds / 1000)
+        self.video.set(cv2.CAP_PROP_POS_MSEC, start.total_seconds() * 1000)
         next_time = start
         while True:
             if self.video.grab():
@@ -262,6 +1413,160 @@ class FrameExtractor:
             else:
                 break
 
+    def frames_by_ffmpeg(self,
+                         start: timedelta = timedelta(),
+                         stop: timedelta = None,
+                         step: timedelta = timedelta(seconds=10),
+                         width: int = None,
+                         buffers: int = None):
+        # A single ffmpeg process seeks to start, samples one frame per step
+        # with the fps filter (and optionally downscales to width), then
+        # writes raw bgr24 frames to a pipe.  Decoding and sampling happen in
+        # one sequential pass in C, and each frame is read straight into a
+        # numpy array with no intermediate bytes object.
+        #
+        # By default every frame gets its own array.  If buffers is given,
+        # frames are read into a ring of that many preallocated arrays
+        # instead, so a Frame's pixels are only valid until buffers more
+        # frames have been yielded -- consumers that hold on to frames (e.g.
+        # find_text_batched) need at least batch_size buffers.
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError("ffmpeg executable not found on PATH")
+        print(self.video_name)
+        W = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        H = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        full_size = (W, H)
+        if width:
+            # libswscale needs even dimensions for most pixel formats
+            (W, H) = (width, int(round(H * width / W / 2)) * 2)
+        step_us = int(step / timedelta(microseconds=1))
+        filters = f"fps=1000000/{step_us},scale={W}:{H}"
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin',
+               '-ss', str(start.total_seconds()), '-i', str(self.path),
+               '-an', '-sn', '-vf', filters,
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        # stderr goes to a file: nothing reads it until ffmpeg exits, and a
+        # damaged file can log enough errors to fill a pipe and stall ffmpeg
+        errors = tempfile.TemporaryFile()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+
+        def read_frame(buffer):
+            view = memoryview(buffer).cast('B')
+            filled = 0
+            while filled < len(view):
+                n = proc.stdout.readinto(view[filled:])
+                if not n:
+                    return False
+                filled += n
+            return True
+
+        ring = None
+        if buffers:
+            ring = [np.empty((H, W, 3), dtype=np.uint8)
+                    for _ in range(buffers)]
+        count = 0
+        begin = time.time()
+        try:
+            while True:
+                timestamp = start + step * count
+                if stop and timestamp > stop:
+                    break
+                if ring:
+                    buffer = ring[count % len(ring)]
+                else:
+                    buffer = np.empty((H, W, 3), dtype=np.uint8)
+                if not read_frame(buffer):
+                    if proc.wait() != 0:
+                        errors.seek(0)
+                        raise RuntimeError("ffmpeg failed: %s" %
+                                           errors.read().decode(
+                                               errors='replace'))
+                    break
+                print(timestamp, end='\r')
+                yield Frame(buffer, self.video_name, timestamp,
+                            full_size=full_size, source=self)
+                count += 1
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            errors.close()
+            elapsed = time.time() - begin
+            self.decode_fps = count / elapsed if elapsed else 0
+            print("[INFO] ffmpeg decoded {} frames in {:.2f} seconds "
+                  "({:.2f} frames/sec)".format(count, elapsed,
+                                               self.decode_fps))
+
+    def benchmark_detection(self,
+                            widths: tuple = (320, 480, 640, 960),
+                            start: timedelta = timedelta(),
+                            stop: timedelta = timedelta(minutes=10),
+                            step: timedelta = timedelta(seconds=30),
+                            min_confidence: float = 0.8,
+                            batch_size: int = 16):
+        # Detection at full resolution is the reference.  For every lower
+        # detection width, boxes that overlap a reference box with IoU >= 0.5
+        # count as found; recall and precision are measured against that.
+        frames = list(self.frames(start, stop, step))
+
+        def detect(width):
+            begin = time.time()
+            if width:
+                inputs = [frame.downscaled(width) for frame in frames]
+            else:
+                inputs = frames
+            output = [results for (_, results, _) in find_text_batched(
+                inputs, batch_size, min_confidence=min_confidence,
+                detection_width=width)]
+            return (time.time() - begin, output)
+
+        def match(reference, candidates):
+            matched = 0
+            unused = list(candidates)
+            for ref in reference:
+                scores = [ref.iou(c) for c in unused]
+                if scores and max(scores) >= 0.5:
+                    unused.pop(scores.index(max(scores)))
+                    matched += 1
+            return matched
+
+        (reference_runtime, reference) = detect(None)
+        reference_count = sum(len(r) for r in reference)
+        fieldnames = ['detection_width', 'runtime', 'frames_per_sec',
+                      'boxes', 'recall', 'precision']
+        results = [{
+            fieldnames[0] : frames[0].image.shape[1] if frames else None,
+            fieldnames[1] : reference_runtime,
+            fieldnames[2] : len(frames) / reference_runtime,
+            fieldnames[3] : reference_count,
+            fieldnames[4] : 1.0,
+            fieldnames[5] : 1.0
+        }]
+        for width in widths:
+            (runtime, output) = detect(width)
+            count = sum(len(r) for r in output)
+            matched = sum(match(ref, out) for (ref, out)
+                          in zip(reference, output))
+            results.append({
+                fieldnames[0] : width,
+                fieldnames[1] : runtime,
+                fieldnames[2] : len(frames) / runtime,
+                fieldnames[3] : count,
+                fieldnames[4] : (matched / reference_count
+                                 if reference_count else 1.0),
+                fieldnames[5] : matched / count if count else 1.0
+            })
+
+        test_path = Path(SOURCE_DIR, 'Tests', 'FrameExtractor',
+                         'detection_width_tradeoff.csv')
+        test_path.parents[0].mkdir(parents=True, exist_ok=True)
+        with test_path.open('w') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for item in results:
+                writer.writerow(item)
+        return results
+
     def benchmark(self,
                   step_low: timedelta = timedelta(seconds=1),
                   step_high: timedelta = timedelta(seconds=10)):
@@ -308,6 +1613,152 @@ class FrameExtractor:
         return results
 
 
+def ordered_results(executor, submissions, max_pending: int):
+    """Submits (tag, func, args) tuples to an executor and yields
+    (tag, result) pairs in submission order, never holding more than
+    max_pending unfinished futures at once.
+    """
+    pending = deque()
+    for (tag, func, args) in submissions:
+        pending.append((tag, executor.submit(func, *args)))
+        if len(pending) >= max_pending:
+            (tag, future) = pending.popleft()
+            yield (tag, future.result())
+    while pending:
+        (tag, future) = pending.popleft()
+        yield (tag, future.result())
+
+
+def extract_segment(video_path: Path, timestamps: list):
+    extractor = FrameExtractor(Path(video_path))
+    return [(frame.timestamp, frame.image)
+            for frame in extractor.frames_at(timestamps)]
+
+
+def init_detection_worker(threads: int = 1, input_size: tuple = None):
+    """ProcessPoolExecutor initializer.  Pins OpenCV's thread pool so that
+    workers don't oversubscribe the machine, then loads the EAST net once and
+    runs a throwaway forward pass so the first real frame doesn't pay for
+    graph initialization.
+    """
+    cv2.setNumThreads(threads)
+    net = Frame.load_east_net()
+    (W, H) = input_size if input_size else (320, 320)
+    blob = np.zeros((1, 3, H, W), dtype=np.float32)
+    net.setInput(blob)
+    net.forward(EAST_LAYER_NAMES)
+
+
+def detect_image(image, shape: tuple, input_size: tuple = None,
+                 min_confidence: float = 0.8):
+    # image may already have been shrunk to the EAST input size by the
+    # parent process, so the ratios are taken from the original shape
+    (H, W) = shape[:2]
+    (newW, newH) = east_input_size(image.shape, input_size)
+    (scores, geometry, _) = Frame(image, None, None).east_forward((newW, newH))
+    ratios = (W / float(newW), H / float(newH))
+    return boxes_from_predictions(scores, geometry, ratios, min_confidence)
+
+
+def detect_segment(video_path: Path,
+                   start: timedelta,
+                   stop: timedelta,
+                   step: timedelta,
+                   batch_size: int = 16,
+                   input_size: tuple = None,
+                   min_confidence: float = 0.8):
+    # decode inside the worker so that only boxes cross the process boundary
+    extractor = FrameExtractor(Path(video_path))
+    frames = extractor.frames(start, stop, step)
+    output = []
+    for (frame, results, confidences) in find_text_batched(frames,
+                                                           batch_size,
+                                                           input_size,
+                                                           min_confidence):
+        output.append((frame.timestamp, results, confidences))
+    return output
+
+
+class TextDetectionPool:
+
+    def __init__(self,
+                 workers: int = None,
+                 threads_per_worker: int = 1,
+                 input_size: tuple = None,
+                 min_confidence: float = 0.8):
+        self.workers = workers or os.cpu_count()
+        self.input_size = input_size
+        self.min_confidence = min_confidence
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_detection_worker,
+            initargs=(threads_per_worker, input_size))
+
+    def _bounded(self, submissions, backlog: int = 2):
+        # keep at most backlog tasks per worker in flight, so that arbitrarily
+        # long frame streams don't pile up in the executor's call queue
+        return ordered_results(self.executor, submissions,
+                               self.workers * backlog)
+
+    def find_text(self, frames):
+        """Detects text in a stream of in-memory Frames.  Yields
+        (frame, results, confidences) in input order.  When an input size is
+        set, frames are shrunk to it before being pickled to a worker.
+        """
+        def submissions():
+            for frame in frames:
+                image = frame.image
+                if self.input_size:
+                    image = cv2.resize(image, self.input_size)
+                (W, H) = frame.full_size
+                args = (image, (H, W), self.input_size,
+                        self.min_confidence)
+                yield (frame, detect_image, args)
+
+        for (frame, (results, confidences)) in self._bounded(submissions()):
+            yield (frame, results, confidences)
+
+    def find_text_in_video(self,
+                           video_path: Path,
+                           start: timedelta = timedelta(),
+                           stop: timedelta = None,
+                           step: timedelta = timedelta(seconds=10),
+                           segment_length: int = 32,
+                           batch_size: int = 16):
+        """Splits [start, stop] into segments of segment_length frames and
+        decodes + detects each one inside a worker, so no pixels are pickled.
+        Yields (timestamp, results, confidences) in timestamp order.
+        """
+        if stop is None:
+            stop = FrameExtractor(Path(video_path)).duration()
+            if stop is None:
+                return      # unreadable video, so no known end
+
+        def submissions():
+            seg_start = start
+            while seg_start <= stop:
+                # segment boundaries sit on the step grid and stop is
+                # inclusive, so no timestamp is visited twice
+                seg_stop = min(seg_start + step * (segment_length - 1), stop)
+                args = (video_path, seg_start, seg_stop, step, batch_size,
+                        self.input_size, self.min_confidence)
+                yield (seg_start, detect_segment, args)
+                seg_start = seg_stop + step
+
+        for (_, segment) in self._bounded(submissions()):
+            yield from segment
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.close()
+        return None
+
+
 if __name__ == '__main__':
     video = Path(ROOT_DIR, 'Videos', 'Politics', 'Tim Pool',
                       '[2021-03-04] Ebay Just NUKED Dr. Seuss Books As OFFENSIVE, RSBN Gets Nuked By Youtube As Censorship Escalates',
@@ -3,7 +3,6 @@ import csv
 import json
 import os
 import re
-import subprocess
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -17,6 +16,8 @@ from tqdm import tqdm
 
 # internal
 #from decorators import *
+from Catalog import catalog
+from MediaProbe import probe_cache
 
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -25,12 +26,9 @@ with Path(ROOT_DIR, "Lists", "channels.json").open() as f:
 
 
 def duration(input_file: Path):
-    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-           '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
+    # cached by path, size and mtime, so unchanged files are never re-probed
     try:
-        return float(result.stdout)
+        return probe_cache.duration(input_file)
     except:
         print(f"Error parsing duration for path: {input_file}")
         raise
@@ -41,11 +39,18 @@ def format_filename(string, remove = "[^-_(),' a-zA-Z0-9]", char_lim = 200):
     return name[:char_lim]
 
 def get_local_channels():
-    parent_dir = Path(ROOT_DIR, "Videos")
-    for channel in parent_dir.iterdir():
-        info = [_ for _ in channel.glob("info.json")]
-        if channel.is_dir() and len(info) > 0:
-            yield Channel(channel)
+    # channels come from the catalog; it's only built from the directory
+    # tree if it has never been built before.  Channels known only from
+    # their videos' info (e.g. indexed by yt.py) have no path and don't count.
+    def local_rows():
+        return [row for row in catalog.channels() if row["path"] is not None]
+
+    rows = local_rows()
+    if not rows:
+        catalog.rebuild(Path(ROOT_DIR, "Videos"))
+        rows = local_rows()
+    for row in rows:
+        yield Channel.from_local(Path(row["path"]))
 
 
 class Channel:
@@ -67,6 +72,7 @@ class Channel:
             self.target_dir.mkdir(parents=True, exist_ok=True)
             with Path(self.target_dir, "info.json").open("w") as outfile:
                 json.dump(self.flatten(), outfile)
+            catalog.add_channel(self.target_dir, self.flatten())
 
     @classmethod
     def from_local(cls, path):
@@ -85,29 +91,33 @@ class Channel:
         if not Path(path, "info.json").exists():
             raise ValueError(f"Channel has no info.json file: {path}")
 
-        video_paths = []
-        for title_dir in path.iterdir():
-            if title_dir.is_dir():
-                for stream_dir in title_dir.iterdir():
-                    info = [p for p in stream_dir.glob("info.json")]
-                    if stream_dir.is_dir() and len(info) > 0:
-                        video_paths.append(stream_dir)
-        video_generator = VideoGenerator(video_paths, local=True)
-
-        with Path(path, "info.json").open("r") as infile:
-            saved = json.load(infile)
-            config_dict = {
-                "fetched_at": datetime.fromisoformat(saved["fetched_at"]),
-                "name": saved["name"],
-                "formatted_name": saved["formatted_name"],
-                "id": saved["id"],
-                "about_html": saved["about_html"],
-                "community_html": saved["community_html"],
-                "featured_channels_html": saved["featured_channels_html"],
-                "videos_html": saved["videos_html"],
-                "videos": video_generator,
-                "total_videos": len(video_generator)
-            }
+        # videos are listed from the catalog rather than by walking the
+        # channel directory and reading every info.json
+        row = catalog.channel_at(path)
+        if row is None:
+            catalog.rebuild(path)
+            row = catalog.channel_at(path)
+        if row is None:
+            raise ValueError(f"Channel info.json is unreadable: {path}")
+        # only this directory's videos, and only those saved by this module
+        # (yt.py stores a different info.json format under the same ids)
+        videos = [v for v in catalog.videos(channel=row["id"], under=path)
+                  if "formatted_title" in v["info"]]
+        video_generator = VideoGenerator(videos, local=True)
+
+        saved = row["info"]
+        config_dict = {
+            "fetched_at": datetime.fromisoformat(saved["fetched_at"]),
+            "name": saved["name"],
+            "formatted_name": saved["formatted_name"],
+            "id": saved["id"],
+            "about_html": saved["about_html"],
+            "community_html": saved["community_html"],
+            "featured_channels_html": saved["featured_channels_html"],
+            "videos_html": saved["videos_html"],
+            "videos": video_generator,
+            "total_videos": len(video_generator)
+        }
         return cls(config_dict, write_info=False)
 
     @classmethod
@@ -217,28 +227,35 @@ class Video:
 
         with Path(path, "info.json").open("r") as infile:
             saved = json.load(infile)
-            config_dict = {
-                "fetched_at": datetime.fromisoformat(saved["fetched_at"]),
-                "url": saved["url"],
-                "id": saved["id"],
-                "title": saved["title"],
-                "formatted_title": saved["formatted_title"],
-                "publish_date": datetime.fromisoformat(saved["publish_date"]),
-                "length": timedelta(seconds=saved["length"]),
-                "channel": {
-                    "name" : saved["channel"]["name"],
-                    "formatted_name": saved["channel"]["formatted_name"],
-                    "id": saved["channel"]["id"],
-                    "url": saved["channel"]["url"]
-                },
-                "description": saved["description"],
-                "keywords": saved["keywords"],
-                "thumbnail_url": saved["thumbnail_url"],
-                "views": saved["views"],
-                "rating": saved["rating"],
-                "captions": None,
-                "streams": None
-            }
+        return cls.from_info(saved)
+
+    @classmethod
+    def from_info(cls, saved):
+        """Factory method. Returns a Video object from the contents of its
+        info.json file (as stored in the catalog, for instance).
+        """
+        config_dict = {
+            "fetched_at": datetime.fromisoformat(saved["fetched_at"]),
+            "url": saved["url"],
+            "id": saved["id"],
+            "title": saved["title"],
+            "formatted_title": saved["formatted_title"],
+            "publish_date": datetime.fromisoformat(saved["publish_date"]),
+            "length": timedelta(seconds=saved["length"]),
+            "channel": {
+                "name" : saved["channel"]["name"],
+                "formatted_name": saved["channel"]["formatted_name"],
+                "id": saved["channel"]["id"],
+                "url": saved["channel"]["url"]
+            },
+            "description": saved["description"],
+            "keywords": saved["keywords"],
+            "thumbnail_url": saved["thumbnail_url"],
+            "views": saved["views"],
+            "rating": saved["rating"],
+            "captions": None,
+            "streams": None
+        }
         return cls(config_dict)
 
     @classmethod
@@ -284,6 +301,7 @@ class Video:
             out.run()
             video_path.unlink()
             audio_path.unlink()
+            catalog.add_video(self.target_dir, self.flatten())
             return True
         return False
 
@@ -349,6 +367,9 @@ class Video:
                                              title=captions_path.name,
                                              srt=True)
 
+        # index the metadata, stats and whatever streams are now on disk
+        catalog.add_video(self.target_dir, self.flatten())
+
     def flatten(self):
         flat = {
             "url" : self.url,
@@ -426,7 +447,9 @@ class VideoGenerator:
     def __iter__(self):
         for obj in self.objs:
             try:
-                if self.local:
+                if self.local and isinstance(obj, dict):
+                    yield Video.from_info(obj["info"])    # a catalog row
+                elif self.local:
                     yield Video.from_local(obj)
                 else:
                     yield Video.from_pytube(obj)
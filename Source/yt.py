@@ -3,7 +3,6 @@ import datetime
 import isodate
 import json
 import os
-import subprocess
 from pathlib import Path
 
 import ffmpeg
@@ -11,6 +10,10 @@ from dotenv import load_dotenv, find_dotenv
 from googleapiclient.discovery import build
 from pytube import YouTube, Playlist
 
+from Source.Catalog import catalog
+from Source.ChannelSync import sync_store
+from Source.MediaProbe import probe_cache
+
 
 load_dotenv(find_dotenv())
 API_KEY = os.getenv('YOUTUBE_API_KEY')
@@ -38,11 +41,8 @@ def format_filename(string):
     return output
 
 def get_duration(input_file: Path):
-    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-           '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    return float(result.stdout)
+    # cached by path, size and mtime, so unchanged files are never re-probed
+    return probe_cache.duration(input_file)
 
 def stitch(video_path: Path, audio_path: Path, output_path: Path):
     if not all([p.exists() for p in [video_path, audio_path]]):
@@ -60,8 +60,11 @@ def stitch(video_path: Path, audio_path: Path, output_path: Path):
 
 class Video:
 
-    def __init__(self, api_response, category):
+    def __init__(self, api_response, category, stats_fresh=True):
         self.fetched_at = datetime.datetime.now()
+        # False for responses replayed from the sync store, whose statistics
+        # date from whenever they were last fetched
+        self.stats_fresh = stats_fresh
         self.id = api_response['id']
         self.url = 'https://www.youtube.com/watch?v=%s' % self.id
         self.category = category
@@ -123,7 +126,8 @@ class Video:
     def download(self, convert=True):
         print(self.__str__())
         self.save_info()
-        self.save_stats()
+        if self.stats_fresh:
+            self.save_stats()
 
         if not self.is_downloaded():
             yt = YouTube(self.url)
@@ -160,6 +164,9 @@ class Video:
                 output_path = Path(self.target_dir, '%s.mp4' % self.id)
                 stitch(video_path, audio_path, output_path)
 
+        # index the metadata, stats and whatever streams are now on disk
+        catalog.add_video(self.target_dir, self.info())
+
     def info(self):
         info = {
             'title' : self.title,
@@ -175,6 +182,11 @@ class Video:
         }
         return info
 
+    def media_paths(self):
+        return [Path(self.target_dir, name) for name in
+                ('%s.mp4' % self.id, '[video] %s.mp4' % self.id,
+                 '[audio] %s.mp4' % self.id)]
+
     def is_downloaded(self, tolerance=4):
         def validate(path):
             if not path.exists():
@@ -226,6 +238,7 @@ class Channel:
     client = None
 
     def __init__(self, id, category):
+        self.id = id
         self.category = category
 
         if not Channel.client:
@@ -252,7 +265,8 @@ class Channel:
         self.videos = None
         self.complete = False
 
-    def uploads(self, depth=None):
+    def uploads(self, depth=None, incremental=True, backfill=False,
+                refresh_stats=False):
         # handle caching
         if self.videos:
             if depth and len(self.videos) >= depth:
@@ -261,7 +275,29 @@ class Channel:
                 return self.videos
 
         # get channel contents from api
-        responses = []
+        if incremental:
+            (responses, fresh) = self.sync(depth=depth, backfill=backfill,
+                                           refresh_stats=refresh_stats)
+        else:
+            responses = []
+            for items in self.playlist_pages():
+                responses.extend(self.lookup(items))
+                if depth and len(responses) >= depth:
+                    responses = responses[:depth]
+                    break
+            fresh = set(r['id'] for r in responses)
+
+        # assign cache
+        self.videos = [Video(r, self.category, stats_fresh=r['id'] in fresh)
+                       for r in responses]
+        if not depth:
+            self.complete = True
+        return self.videos
+
+    def playlist_pages(self):
+        """Yields the upload playlist's items a page at a time, newest
+        first.
+        """
         next_page_token = None
         while True:
             playlist_request = Channel.client.playlistItems().list(
@@ -270,27 +306,99 @@ class Channel:
                 maxResults = 50,
                 pageToken = next_page_token
             ).execute()
-
-            ids = ','.join(map(lambda x: x['snippet']['resourceId']['videoId'],
-                               playlist_request['items']))
-            video_request = Channel.client.videos().list(
-                id = ids,
-                part = 'snippet,statistics,contentDetails'
-            ).execute()
-            responses.extend(video_request['items'])
-            if depth and len(responses) >= depth:
-                responses = responses[:depth]
-                break
+            yield playlist_request['items']
 
             next_page_token = playlist_request.get('nextPageToken')
             if next_page_token is None:
                 break
 
-        # assign cache
-        self.videos = [Video(r, self.category) for r in responses]
-        if not depth:
-            self.complete = True
-        return self.videos
+    def lookup(self, items):
+        ids = [item['snippet']['resourceId']['videoId'] for item in items]
+        if not ids:
+            return []
+        video_request = Channel.client.videos().list(
+            id = ','.join(ids),
+            part = 'snippet,statistics,contentDetails'
+        ).execute()
+        return video_request['items']
+
+    def sync(self, depth=None, backfill=False, refresh_stats=False):
+        """Fetches uploads newer than the ones already stored for this
+        channel.  Returns the stored responses, newest first, and the ids of
+        those whose statistics were fetched during this sync.
+
+        Paging stops at the first page that reaches a known video (by id,
+        or by being published no later than the newest one stored), and
+        only the unknown videos on each page are looked up.  With
+        backfill, paging carries on to the end of the playlist instead,
+        until that has been done once for the channel.
+
+        Statistics of already stored videos are only refreshed (one request
+        per 50 videos) for the depth newest uploads, or for all of them with
+        refresh_stats, so a routine full sync stays at a page or two.
+        """
+        state = sync_store.state(self.id)
+        newest = state['newest_published'] if state else None
+        backfill = backfill and not (state and state['complete'])
+
+        pages = 0
+        added = set()
+        reached_end = True
+        for items in self.playlist_pages():
+            pages += 1
+            ids = [item['snippet']['resourceId']['videoId'] for item in items]
+            known = sync_store.known(self.id, ids)
+            new_items = [item for (item, id) in zip(items, ids)
+                         if id not in known]
+            responses = self.lookup(new_items)
+            sync_store.add(self.id, responses)
+            added.update(r['id'] for r in responses)
+
+            published = [item['contentDetails'].get('videoPublishedAt')
+                         for item in items]
+            reached_known = known or (newest and any(
+                p and p <= newest for p in published))
+            if reached_known and not backfill:
+                reached_end = False
+                break
+            if depth and len(added) >= depth and not backfill:
+                reached_end = False
+                break
+        if reached_end:
+            sync_store.mark_complete(self.id)
+
+        responses = sync_store.responses(self.id, limit=depth)
+        stored = [r for r in responses if r['id'] not in added]
+        if not (depth or refresh_stats):
+            stored = []
+        refreshed = self.refresh_statistics(stored)
+        print(f"[INFO] synced {self.name}: {len(added)} new uploads "
+              f"from {pages} pages, {len(refreshed)} stats refreshed")
+        # refreshed videos that have since been deleted or made private are
+        # dropped
+        gone = set(r['id'] for r in stored) - refreshed
+        responses = [r for r in responses if r['id'] not in gone]
+        return (responses, added | refreshed)
+
+    def refresh_statistics(self, responses):
+        """Replaces the statistics of stored responses with current ones
+        and stores them again.  Returns the ids that were refreshed.
+        """
+        refreshed = set()
+        for i in range(0, len(responses), 50):
+            batch = responses[i:i + 50]
+            video_request = Channel.client.videos().list(
+                id = ','.join(r['id'] for r in batch),
+                part = 'statistics'
+            ).execute()
+            statistics = {item['id']: item['statistics']
+                          for item in video_request['items']}
+            batch = [r for r in batch if r['id'] in statistics]
+            for r in batch:
+                r['statistics'] = statistics[r['id']]
+            sync_store.add(self.id, batch)
+            refreshed.update(r['id'] for r in batch)
+        return refreshed
 
     def info(self):
         info = {
@@ -301,12 +409,13 @@ class Channel:
         return info
 
     def undownloaded(self, depth=None):
-        if self.videos:
-            if depth and len(self.videos) >= depth:
-                return [v for v in self.videos[:depth]
-                                if not v.is_downloaded()]
-            elif self.complete:
-                return [v for v in self.videos if not v.is_downloaded()]
+        if self.videos and depth and len(self.videos) >= depth:
+            videos = self.videos[:depth]
+        elif self.videos and self.complete:
+            videos = self.videos
+        else:
+            videos = self.uploads(depth=depth)
 
-        videos = self.uploads(depth=depth)
+        # probe any new or changed files in parallel before checking them
+        probe_cache.get_many(p for v in videos for p in v.media_paths())
         return [v for v in videos if not v.is_downloaded()]